@@ -0,0 +1,117 @@
+'''
+Dynamic micro-batching for the scoring script
+
+Each HTTP request to the endpoint calls `run()` in its own thread. Instead of calling
+`MODEL.predict` once per request, the `MicroBatcher` queues the rows of every request,
+and a single background thread coalesces whatever has arrived into one `predict` call.
+The predictions are then split back up and handed to the waiting requests.
+
+A batch is flushed when either:
+- it holds `max_batch_size` rows, or
+- `max_wait_ms` milliseconds have passed since the first request in the batch arrived
+
+so a lone request never waits more than `max_wait_ms` longer than it would without batching.
+'''
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+
+class MicroBatcher:
+    '''
+    Coalesces concurrent `submit()` calls into batched calls of `predict_fn`
+    '''
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray], max_batch_size=64, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError(f'max_batch_size must be at least 1, got {max_batch_size}')
+        if max_wait_ms < 0:
+            raise ValueError(f'max_wait_ms must not be negative, got {max_wait_ms}')
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue: 'queue.Queue[tuple[np.ndarray, Future]]' = queue.Queue()
+        # nothing can be queued after the `None` that `shutdown()` queues to stop the worker
+        self._closed = False
+        self._close_lock = threading.Lock()
+        # daemon thread, so it doesn't keep the scoring server alive on shutdown
+        self._worker = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, data: np.ndarray) -> np.ndarray:
+        '''
+        Queues `data` (a 2D array of rows) for prediction and blocks until its predictions are ready.
+        Exceptions raised by `predict_fn` are re-raised here, in the calling thread.
+        '''
+        future: Future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError('The micro-batcher was shut down')
+            self._queue.put((np.asarray(data), future))
+        return future.result()
+
+    def shutdown(self, wait=True):
+        '''Predicts the requests already queued, then stops the worker thread'''
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _loop(self):
+        while True:
+            # block until there is at least one request, then start the batch timer
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            n_rows = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+
+            while n_rows < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._run_batch(batch)
+                    return
+                batch.append(item)
+                n_rows += len(item[0])
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: 'list[tuple[np.ndarray, Future]]'):
+        # a single request can be bigger than `max_batch_size`, we don't split those up
+        try:
+            if len(batch) == 1:
+                results = [self.predict_fn(batch[0][0])]
+            else:
+                rows = np.concatenate([data for data, _ in batch])
+                predictions = self.predict_fn(rows)
+                # split the predictions back up at the request boundaries
+                offsets = np.cumsum([len(data) for data, _ in batch])[:-1]
+                results = np.split(predictions, offsets)
+        except Exception:
+            # one bad request (e.g. wrong number of columns) shouldn't fail the whole batch,
+            # so fall back to predicting each request on its own
+            for data, future in batch:
+                try:
+                    future.set_result(self.predict_fn(data))
+                except Exception as err:
+                    future.set_exception(err)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
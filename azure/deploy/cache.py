@@ -0,0 +1,82 @@
+'''
+LRU cache of predictions, for clients that send the same rows more than once (retries, re-reads of a case)
+
+Rows are looked up one by one, so a batch that is only partly cached only predicts its misses.
+Keys are a hash of the model version and the exact bytes of the row (as float64),
+so the cache never returns a prediction made by a different model.
+'''
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+
+class PredictionCache:
+    '''
+    Bounded LRU cache mapping rows to predictions, with hit/miss/eviction counters
+    '''
+
+    def __init__(self, max_size: int, version: str):
+        if max_size < 1:
+            raise ValueError(f'max_size must be at least 1, got {max_size}')
+        self.max_size = max_size
+        self.version = version
+
+        self._entries: 'OrderedDict[bytes, object]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, row: np.ndarray) -> bytes:
+        digest = hashlib.blake2b(self.version.encode(), digest_size=16)
+        digest.update(row.tobytes())
+        return digest.digest()
+
+    def predict(self, data, predict_fn: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        '''
+        Returns the predictions for every row of `data`, calling `predict_fn` only on the rows that aren't cached
+        '''
+        # the same values should hit the cache whichever format/dtype they were sent in
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        keys = [self._key(row) for row in data]
+
+        results: list = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    results[i] = self._entries[key]
+                else:
+                    missing.append(i)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            predictions = predict_fn(data[missing])
+            with self._lock:
+                for i, prediction in zip(missing, predictions):
+                    results[i] = prediction
+                    self._entries[keys[i]] = prediction
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return np.asarray(results)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,174 @@
+'''
+Request instrumentation for the scoring script, exported in the Prometheus text format
+
+Every request to `run()` gets a `Trace`, which `score.py` marks at the end of each phase:
+- `parse`: decoding and validating the body (see `validation.py`)
+- `predict`: scaling, the cache and `MODEL.predict` (including any wait for the micro-batcher)
+- `serialize`: converting the predictions with `tolist()`
+
+`RequestMetrics.finish()` then adds the phase times (and their total) to fixed-bucket histograms,
+the number of rows to a batch size histogram, and counts errors by exception type.
+Timers are `time.perf_counter()` and the histograms are plain lists, so this costs
+a couple of microseconds per request (see `tests/instrumentation`).
+
+A fraction of requests (`trace_sample_rate`) also keep their full trace, for `GET /score?traces`.
+'''
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PHASES = ('parse', 'predict', 'serialize')
+
+# upper bounds of the latency buckets, in seconds (100us to 2.5s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# upper bounds of the rows per request buckets
+ROWS_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384)
+
+_local = threading.local()
+
+
+class Histogram:
+    '''
+    Counts of observations in fixed buckets, like a Prometheus histogram (buckets are rendered cumulative)
+    '''
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # the last count is for values above every bound (`le="+Inf"`)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = '') -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        labels = f'{{{labels.rstrip(",")}}}' if labels else ''
+        lines.append(f'{name}_sum{labels} {self.sum!r}')
+        lines.append(f'{name}_count{labels} {self.count}')
+        return lines
+
+
+class Trace:
+    '''The phase timings of a single request'''
+
+    __slots__ = ('start', 'last', 'phases', 'rows', 'error')
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.phases = {}
+        self.rows = 0
+        self.error = None
+
+    def mark(self, phase: str):
+        '''Ends `phase`: the time since the previous mark (or the start of the request) is spent in it'''
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+
+class _NoTrace:
+    '''Stands in for a `Trace` outside of requests (e.g. the warm-up prediction in `init()`)'''
+
+    # written to like a trace's, and never read
+    rows = 0
+
+    def mark(self, phase: str):
+        pass
+
+
+NO_TRACE = _NoTrace()
+
+
+def current():
+    '''The trace of the request being handled by this thread, or `NO_TRACE`'''
+    return getattr(_local, 'trace', NO_TRACE)
+
+
+class RequestMetrics:
+    '''
+    Per-phase latency histograms, batch size histogram and error counters of the scoring script's requests
+    '''
+
+    def __init__(self, trace_sample_rate=0.0, max_traces=100):
+        if not 0 <= trace_sample_rate <= 1:
+            raise ValueError(f'trace_sample_rate must be between 0 and 1, got {trace_sample_rate}')
+        self.trace_sample_rate = trace_sample_rate
+
+        self._lock = threading.Lock()
+        self.latency = {phase: Histogram(LATENCY_BUCKETS) for phase in PHASES + ('total',)}
+        self.rows = Histogram(ROWS_BUCKETS)
+        self.errors = {}
+        self._traces = deque(maxlen=max_traces)
+
+    def start(self) -> Trace:
+        '''Starts timing a request, and makes its trace `current()` in this thread'''
+        trace = _local.trace = Trace()
+        return trace
+
+    def finish(self, trace: Trace):
+        '''Records a request's timings'''
+        _local.trace = NO_TRACE
+        total = time.perf_counter() - trace.start
+        with self._lock:
+            for phase, elapsed in trace.phases.items():
+                self.latency[phase].observe(elapsed)
+            self.latency['total'].observe(total)
+            if trace.rows:
+                self.rows.observe(trace.rows)
+            if trace.error is not None:
+                self.errors[trace.error] = self.errors.get(trace.error, 0) + 1
+
+        if self.trace_sample_rate and random.random() < self.trace_sample_rate:
+            self._traces.append({
+                'time': time.time(),
+                'rows': trace.rows,
+                'error': trace.error,
+                'total_ms': total * 1000,
+                **{f'{phase}_ms': elapsed * 1000 for phase, elapsed in trace.phases.items()},
+            })
+
+    def traces(self) -> list:
+        '''The latest sampled request traces'''
+        return list(self._traces)
+
+    def render(self) -> str:
+        '''All the metrics, in the Prometheus text format'''
+        with self._lock:
+            lines = [
+                '# HELP score_request_duration_seconds Time spent in each phase of a scoring request',
+                '# TYPE score_request_duration_seconds histogram',
+            ]
+            for phase, histogram in self.latency.items():
+                lines += histogram.render('score_request_duration_seconds', f'phase="{phase}",')
+
+            lines += [
+                '# HELP score_request_rows Rows per scoring request',
+                '# TYPE score_request_rows histogram',
+            ]
+            lines += self.rows.render('score_request_rows')
+
+            lines += [
+                '# HELP score_requests_total Scoring requests handled',
+                '# TYPE score_requests_total counter',
+                f'score_requests_total {self.latency["total"].count}',
+                '# HELP score_rows_total Rows scored',
+                '# TYPE score_rows_total counter',
+                f'score_rows_total {int(self.rows.sum)}',
+                '# HELP score_errors_total Scoring requests that failed, by exception type',
+                '# TYPE score_errors_total counter',
+            ]
+            lines += [f'score_errors_total{{type="{error}"}} {count}' for error, count in sorted(self.errors.items())]
+        return '\n'.join(lines) + '\n'
@@ -3,16 +3,32 @@ Deploys the latest model to the Azure ML service as a managed online endpoint
 
 A lot of the deploy code is very similar to testing a local endpoint, 
 so much of the code is shared in `lib/deploy_helpers.py`.
+
+With `CHALLENGER_MODEL_VERSION` set, the challenger is deployed alongside the latest model in the same
+deployment, and scores the latest model's requests in shadow mode (see `azure/deploy/models.py`).
 '''
+import os
 
 # relative imports from lib/deploy_helpers.py
 import deploy_helpers as helper
 
 if __name__ == '__main__':
     client = helper.get_mlclient()
-    model = helper.get_latest_model(client, local=False)
-    environment = helper.ml_environment(client, local=False)
-    endpoint = helper.create_or_update_endpoint(client, local=False)
-    deployment_name = helper.create_or_update_deployment(client, model, environment, endpoint, local=False)
+    # model, environment and endpoint are resolved concurrently
+    model, environment, endpoint = helper.resolve_resources(client, local=False)
+
+    environment_variables = {}
+    challenger = os.getenv('CHALLENGER_MODEL_VERSION')
+    if challenger and challenger != model.version:
+        model_version = model.version
+        model = helper.get_cohosted_model(client, [challenger, model_version])
+        environment_variables = {'SCORE_CHAMPION': model_version, 'SCORE_SHADOW': challenger}
+
+    with helper.timed('create_or_update_deployment'):
+        deployment_name = helper.create_or_update_deployment(
+            client, model, environment, endpoint, local=False, environment_variables=environment_variables
+        )
 
-    helper.post_deployment(client, deployment_name, local=False)
+    with helper.timed('post_deployment'):
+        helper.post_deployment(client, deployment_name, local=False)
+    helper.print_timings()
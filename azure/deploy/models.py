@@ -0,0 +1,195 @@
+'''
+Co-hosting several model versions in one deployment
+
+A deployment normally serves the single model version it was created with, so `AZUREML_MODEL_DIR`
+holds one `wisconsin-BCa-model` folder. It can also hold several, one per version
+(`<version>/wisconsin-BCa-model`, see `get_cohosted_model()` in `lib/deploy_helpers.py`), in which case
+`score.py` loads them all into the same process. Requests are parsed and validated once, then routed:
+- to the version in the `X-Model-Version` header, or the `"model_version"` field of a JSON body
+- to the champion (`SCORE_CHAMPION`, the latest version by default) otherwise
+
+A `Shadow` can also score the champion's requests with a candidate version in a background thread,
+counting (and logging) the rows where the two disagree, without delaying the response.
+'''
+import glob
+import os
+import queue
+import threading
+from typing import Callable
+
+import numpy as np
+
+from batching import MicroBatcher
+from cache import PredictionCache
+from pool import PredictPool
+
+MODEL_NAME = 'wisconsin-BCa-model'
+VERSION_HEADER = 'X-Model-Version'
+
+
+def discover(model_dir: str) -> dict:
+    '''
+    The model folders under `model_dir`, by version (in version order). A lone `wisconsin-BCa-model`
+    folder is the version `model_dir` was downloaded as (`./azureml-models/$MODEL_NAME/$VERSION`)
+    '''
+    single = os.path.join(model_dir, MODEL_NAME)
+    if os.path.isdir(single):
+        return {os.path.basename(os.path.normpath(model_dir)): single}
+
+    # `<version>/wisconsin-BCa-model`, possibly under the folder the co-hosted model was uploaded from
+    folders = {}
+    for pattern in ('*', os.path.join('*', '*')):
+        for folder in glob.glob(os.path.join(model_dir, pattern, MODEL_NAME)):
+            folders.setdefault(os.path.basename(os.path.dirname(folder)), folder)
+    if not folders:
+        raise FileNotFoundError(f'No {MODEL_NAME} folders found in {model_dir}')
+    return {version: folders[version] for version in sorted(folders, key=version_key)}
+
+
+def version_key(version: str):
+    '''Sorts numeric versions as numbers, after any others'''
+    return (1, int(version), '') if version.isdigit() else (0, 0, version)
+
+
+class ServedModel:
+    '''
+    One model version and what serves it: its scaler, and the optional cache, process pool and micro-batcher
+    (see `score.py` for the environment variables that enable them)
+    '''
+
+    def __init__(self, version: str, model, scaler=None, cache: PredictionCache = None,
+                 pool: PredictPool = None, batcher: MicroBatcher = None):
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.cache = cache
+        self.pool = pool
+        self.batcher = batcher
+
+    def predict_uncached(self, data: np.ndarray) -> np.ndarray:
+        if self.scaler is not None:
+            data = self.scaler.transform(data)
+        if self.batcher is not None:
+            return self.batcher.submit(data)
+        if self.pool is not None:
+            return self.pool.predict(data)
+        return self.model.predict(data)
+
+    def predict(self, data: np.ndarray) -> np.ndarray:
+        if self.cache is not None:
+            return self.cache.predict(data, self.predict_uncached)
+        return self.predict_uncached(data)
+
+    def shutdown(self):
+        '''Stops the micro-batcher's thread and the pool's processes (the cache may be reused, see `score.py`)'''
+        # the batcher first, it may still be predicting with the pool
+        if self.batcher is not None:
+            self.batcher.shutdown()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def describe(self) -> dict:
+        return {
+            'model': type(self.model).__name__,
+            'scaled': self.scaler is not None,
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+
+class Shadow:
+    '''
+    Scores requests with a candidate model in a background thread, and compares its predictions with the champion's.
+    At most `max_pending` requests wait to be scored, later ones are dropped rather than piling up
+    '''
+
+    def __init__(self, version: str, predict_fn: Callable[[np.ndarray], np.ndarray], max_pending=1000):
+        self.version = version
+        self.predict_fn = predict_fn
+
+        self._queue: 'queue.Queue[tuple[np.ndarray, np.ndarray]]' = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.disagreements = 0
+        self.dropped = 0
+        self.errors = 0
+        self._closed = False
+
+        # daemon thread, so it doesn't keep the scoring server alive on shutdown
+        self._worker = threading.Thread(target=self._loop, name='shadow', daemon=True)
+        self._worker.start()
+
+    def submit(self, data: np.ndarray, champion_predictions: np.ndarray):
+        '''Queues `data` to be scored by the shadow model, without waiting for it'''
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait((data, champion_predictions))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def shutdown(self, wait=True):
+        '''Stops the worker thread, skipping the requests still waiting to be shadowed'''
+        self._closed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._queue.put(None)
+        if wait:
+            self._worker.join()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            data, champion_predictions = item
+            try:
+                predictions = self.predict_fn(data)
+            except Exception as err:
+                print(f'Shadow model {self.version} failed: {err}')
+                with self._lock:
+                    self.errors += 1
+                continue
+
+            disagreeing = np.flatnonzero(np.asarray(predictions) != np.asarray(champion_predictions))
+            with self._lock:
+                self.requests += 1
+                self.rows += len(data)
+                self.disagreements += len(disagreeing)
+            if len(disagreeing):
+                print(f'Shadow model {self.version} disagrees with the champion on rows {disagreeing[:10].tolist()} '
+                      f'({len(disagreeing)}/{len(data)})')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'version': self.version,
+                'requests': self.requests,
+                'rows': self.rows,
+                'disagreements': self.disagreements,
+                'disagreement_rate': self.disagreements / self.rows if self.rows else 0.0,
+                'dropped': self.dropped,
+                'errors': self.errors,
+            }
+
+    def render(self) -> str:
+        '''The counters, in the Prometheus text format (see `instrumentation.py`)'''
+        stats = self.stats()
+        labels = f'{{version="{self.version}"}}'
+        lines = []
+        for name, help_text in (
+            ('rows', 'Rows scored by the shadow model'),
+            ('disagreements', 'Rows the shadow model predicted differently than the champion'),
+            ('dropped', 'Requests not shadowed because the shadow model was behind'),
+            ('errors', 'Requests the shadow model failed to score'),
+        ):
+            lines += [
+                f'# HELP score_shadow_{name}_total {help_text}',
+                f'# TYPE score_shadow_{name}_total counter',
+                f'score_shadow_{name}_total{labels} {stats[name]}',
+            ]
+        return '\n'.join(lines) + '\n'
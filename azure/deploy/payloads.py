@@ -0,0 +1,151 @@
+'''
+Decoding request bodies into feature matrices
+
+On top of the default `{"data": [[...], ...]}` JSON arrays, the endpoint accepts:
+- JSON records, `{"data": [{"texture_mean": ..., ...}, ...]}`
+- JSON columns, `{"data": {"texture_mean": [...], ...}}`
+- `.npy` arrays of float32/float64, with `Content-Type: application/x-npy`
+- Arrow IPC streams/files, with `Content-Type: application/vnd.apache.arrow.stream` (or `.file`)
+
+The binary formats are read straight into NumPy arrays, without any per-element Python parsing,
+which is what makes them worth it for bulk scoring clients.
+
+JSON bodies can also pick the model version to score with (see `models.py`), with a `"model_version"` field
+next to `"data"`. Binary bodies can only use the `X-Model-Version` header.
+'''
+import io
+import json
+from operator import itemgetter
+
+import numpy as np
+
+# A copy of `NUMERIC_COLS` in `lib/pipeline/constants.py`, in the column order the model expects
+# (only the `azure/deploy` folder is uploaded with the scoring script, `tests/copies` checks they match)
+FEATURE_COLS = (
+    'texture_mean',
+    'smoothness_mean',
+    'compactness_mean',
+    'concavity_mean',
+    'concave points_mean',
+    'symmetry_mean',
+    'fractal_dimension_mean',
+    'radius_se',
+    'texture_se',
+    'perimeter_se',
+    'area_se',
+    'smoothness_se',
+    'compactness_se',
+    'concavity_se',
+    'concave points_se',
+    'symmetry_se',
+    'fractal_dimension_se',
+    'texture_worst',
+    'perimeter_worst',
+    'area_worst',
+    'smoothness_worst',
+    'compactness_worst',
+    'concavity_worst',
+    'concave points_worst',
+    'symmetry_worst',
+    'fractal_dimension_worst',
+)
+
+# precomputed once: pulls the feature values out of a record in column order
+_RECORD_GETTER = itemgetter(*FEATURE_COLS)
+
+JSON_TYPES = ('', 'application/json', 'text/plain')
+NPY_TYPES = ('application/x-npy', 'application/octet-stream')
+ARROW_TYPES = ('application/vnd.apache.arrow.stream', 'application/vnd.apache.arrow.file')
+
+BINARY_DTYPES = (np.float32, np.float64)
+
+
+def decode(body: bytes, content_type: str) -> tuple:
+    '''
+    Decodes a request body according to its content type, into `(data, model_version)`.
+
+    JSON bodies are returned as lists of rows, the records and columns formats with the values in `FEATURE_COLS` order,
+    so the caller can check the type of every value and report the bad rows (see `validation.py`).
+    Every other format is returned as a 2D float64 array with the columns in `FEATURE_COLS` order.
+    `model_version` is the JSON `model_version` field, or None.
+    '''
+    # drop parameters like `; charset=utf-8`
+    content_type = content_type.split(';')[0].strip().lower()
+
+    if content_type in JSON_TYPES:
+        return decode_json(body)
+    if content_type in NPY_TYPES:
+        return decode_npy(body), None
+    if content_type in ARROW_TYPES:
+        return decode_arrow(body), None
+    raise ValueError(f'Unsupported content type {content_type!r}')
+
+
+def decode_json(body: bytes) -> tuple:
+    payload = json.loads(body)
+    if not isinstance(payload, dict) or 'data' not in payload:
+        raise ValueError('Expected a JSON object with a "data" field')
+    data = payload['data']
+    version = payload.get('model_version')
+    if version is not None:
+        version = str(version)
+
+    # columns: {"texture_mean": [...], ...}, transposed into rows
+    if isinstance(data, dict):
+        missing = [name for name in FEATURE_COLS if name not in data]
+        if missing:
+            raise ValueError(f'Missing columns: {missing}')
+        columns = [data[name] for name in FEATURE_COLS]
+        if not all(isinstance(column, list) for column in columns):
+            raise ValueError('Expected every column to be a list of values')
+        if len(set(map(len, columns))) > 1:
+            raise ValueError('Expected every column to have the same number of values')
+        return list(map(list, zip(*columns))), version
+
+    # records: [{"texture_mean": ..., ...}, ...]
+    if isinstance(data, list) and data and isinstance(data[0], dict):
+        if not all(isinstance(record, dict) for record in data):
+            raise ValueError('Expected every record to be an object')
+        try:
+            return list(map(list, map(_RECORD_GETTER, data))), version
+        except KeyError as err:
+            raise ValueError(f'Record is missing column {err}') from err
+
+    # default: [[...], ...]
+    return data, version
+
+
+def decode_npy(body: bytes) -> np.ndarray:
+    data = np.load(io.BytesIO(body), allow_pickle=False)
+    if data.dtype not in BINARY_DTYPES:
+        raise ValueError(f'Expected a float32 or float64 array, got {data.dtype}')
+    return _as_matrix(data)
+
+
+def decode_arrow(body: bytes) -> np.ndarray:
+    # pyarrow is only needed for Arrow requests, so don't make it a hard requirement of the endpoint
+    try:
+        import pyarrow as pa
+    except ImportError as err:
+        raise ValueError('Arrow request bodies need pyarrow installed on the endpoint') from err
+
+    try:
+        table = pa.ipc.open_stream(body).read_all()
+    except pa.ArrowInvalid:
+        table = pa.ipc.open_file(body).read_all()
+
+    missing = [name for name in FEATURE_COLS if name not in table.column_names]
+    if missing:
+        raise ValueError(f'Missing columns: {missing}')
+    return np.column_stack([
+        table.column(name).to_numpy().astype(np.float64, copy=False) for name in FEATURE_COLS
+    ])
+
+
+def _as_matrix(data: np.ndarray) -> np.ndarray:
+    # a single row can be sent as a 1D array
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    if data.ndim != 2 or data.shape[1] != len(FEATURE_COLS):
+        raise ValueError(f'Expected an array of shape (n, {len(FEATURE_COLS)}), got {data.shape}')
+    return data.astype(np.float64, copy=False)
@@ -0,0 +1,61 @@
+'''
+Process-pool prediction for the scoring script
+
+Apart from the matrix product (which BLAS may already spread over threads), NumPy predicts on a single core,
+and the threads of one scoring worker share its GIL. `PredictPool` starts `processes` worker processes that each load the
+compiled model memory-mapped (see `CompiledSVC.load(..., mmap=True)`), so they all share one physical
+copy of it, and splits batches of at least `min_rows` rows across them. Smaller batches aren't worth
+the round trip to another process, and are predicted in the calling process as usual.
+'''
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+import compiled_model
+
+# the model of a worker process, loaded by `_init_worker()`
+_MODEL = None
+
+
+def _init_worker(model_path: str):
+    global _MODEL
+    _MODEL = compiled_model.CompiledSVC.load(model_path, mmap=True)
+
+
+def _predict(rows: np.ndarray) -> np.ndarray:
+    return _MODEL.predict(rows)
+
+
+class PredictPool:
+    '''
+    Splits large batches across worker processes, and predicts the others with `predict_fn` in this one
+    '''
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray], model_path: str, processes: int, min_rows=256):
+        if processes < 1:
+            raise ValueError(f'processes must be at least 1, got {processes}')
+        self.predict_fn = predict_fn
+        self.processes = processes
+        self.min_rows = min_rows
+        # spawned rather than forked, the scoring worker may already be running threads (e.g. the micro-batcher's)
+        self._pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(model_path,)
+        )
+
+    def warm_up(self, rows: np.ndarray):
+        '''Starts every worker process (and loads its model), instead of on the first large request'''
+        list(self._pool.map(_predict, [rows] * self.processes))
+
+    def predict(self, data: np.ndarray) -> np.ndarray:
+        if len(data) < self.min_rows:
+            return self.predict_fn(data)
+        chunks = np.array_split(data, self.processes)
+        return np.concatenate(list(self._pool.map(_predict, chunks)))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
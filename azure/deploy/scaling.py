@@ -0,0 +1,32 @@
+'''
+Applies the feature scaling fitted by the clean stage, see `lib/pipeline/scaling.py`
+
+This is a copy of `Standardizer` in `lib/pipeline/scaling.py` (minus `fit()`, `save()` and `inverse_transform()`),
+since only the `azure/deploy` folder is uploaded with the scoring script. `tests/copies` checks the two are in sync.
+'''
+import numpy as np
+
+# saved next to `model.pkl` by the train component
+FILE_NAME = 'scaler.npz'
+
+
+class Standardizer:
+    '''
+    Scales every column to zero mean and unit variance, like sklearn's `StandardScaler`
+    '''
+
+    def __init__(self, columns, mean, scale):
+        self.columns = [str(column) for column in columns]
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if X.shape[-1] != len(self.columns):
+            raise ValueError(f'Expected {len(self.columns)} features, got {X.shape[-1]}')
+        return (X - self.mean) / self.scale
+
+    @classmethod
+    def load(cls, path) -> 'Standardizer':
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays['columns'].tolist(), arrays['mean'], arrays['scale'])
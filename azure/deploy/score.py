@@ -1,13 +1,62 @@
 import os
-import joblib
+import time
 import numpy as np
 
+import compiled_model
+import instrumentation
+import models
+import payloads
+import scaling
+import validation
+from batching import MicroBatcher
+from cache import PredictionCache
+from pool import PredictPool
+
+from azureml.contrib.services.aml_request import AMLRequest, rawhttp
+from azureml.contrib.services.aml_response import AMLResponse
 from inference_schema.schema_decorators import input_schema, output_schema
+from inference_schema.schema_util import get_input_schema, get_output_schema
 from inference_schema.parameter_types.numpy_parameter_type import NumpyParameterType
 
 
+# Every model version found in AZUREML_MODEL_DIR, by version (see `models.py`), and the one requests go to
+# unless they ask for another with the `X-Model-Version` header or a `"model_version"` JSON field:
+# - SCORE_CHAMPION: the default version (the latest one otherwise)
+MODELS = {}
+CHAMPION = None
+
+# Shadow scoring is opt-in, and needs a second version co-hosted:
+# - SCORE_SHADOW: version to also score the champion's requests with, in the background
+# - SCORE_SHADOW_QUEUE: requests waiting to be shadowed before later ones are skipped
+SHADOW = None
+
+# Micro-batching is opt-in, and configured with environment variables on the deployment:
+# - SCORE_BATCHING: set to 1 to coalesce concurrent requests into one `predict` call
+# - SCORE_MAX_BATCH_SIZE: flush a batch once it holds this many rows
+# - SCORE_MAX_WAIT_MS: flush a batch once its first request has waited this long
+
+# Prediction caching is opt-in too:
+# - SCORE_CACHE_SIZE: number of rows to keep predictions for, per model version (0 disables the cache)
+
+# Process-pool prediction is opt-in, see `pool.py`:
+# - SCORE_PROCESSES: number of worker processes per model version to split large batches across (0 predicts in this process)
+# - SCORE_POOL_MIN_ROWS: only batches of at least this many rows are split
+
+# Request instrumentation (see `instrumentation.py`), served in the Prometheus format by `GET /score?metrics`:
+# - SCORE_METRICS: set to 0 to disable it
+# - SCORE_TRACE_SAMPLE_RATE: fraction of requests to keep full traces of, for `GET /score?traces`
+METRICS = None
+
+# Checks the shape and values of every request (once, whichever model it goes to), see `validation.py`
+VALIDATOR = None
+
+# Set at the end of `init()`, once the models are loaded and warmed up.
+# Returned on GET requests, so deploys can wait on it instead of polling with predictions
+READY = False
+
+
 def init():
-    global MODEL
+    global MODELS, CHAMPION, SHADOW, METRICS, VALIDATOR, READY
     # AZUREML_MODEL_DIR is an environment variable created during deployment.
     # It is the path to the model folder (./azureml-models/$MODEL_NAME/$VERSION)
     # For multiple models, it points to the folder containing all deployed models (./azureml-models)
@@ -15,61 +64,230 @@ def init():
     if model_dir is None:
         # throw error
         raise Exception('No model directory found')
-    
-    # The model path is somewhat determined by how we register and download our model
-    # See: `lib/deploy_helpers.py`, specifically `get_latest_model()`
-    model_path = os.path.join(model_dir, 'wisconsin-BCa-model/model.pkl')
-    # Deserialize the model file back into a sklearn model.
-    MODEL = joblib.load(model_path)
+
+    VALIDATOR = validation.FeatureValidator(payloads.FEATURE_COLS)
+
+    # keep counting across reloads of the model
+    if os.getenv('SCORE_METRICS', '1') == '1' and METRICS is None:
+        METRICS = instrumentation.RequestMetrics(float(os.getenv('SCORE_TRACE_SAMPLE_RATE', '0')))
+
+    # we're loading (possibly new) models: stop the old ones' batcher threads, worker processes and shadow thread
+    previous = MODELS
+    for served in previous.values():
+        served.shutdown()
+    if SHADOW is not None:
+        SHADOW.shutdown()
+        SHADOW = None
+
+    # The model paths are somewhat determined by how we register and download our models
+    # See: `lib/deploy_helpers.py`, specifically `get_latest_model()` and `get_cohosted_model()`
+    MODELS = {
+        version: _load_model(version, folder, previous.get(version))
+        for version, folder in models.discover(model_dir).items()
+    }
+
+    CHAMPION = os.getenv('SCORE_CHAMPION') or list(MODELS)[-1]
+    if CHAMPION not in MODELS:
+        raise Exception(f'SCORE_CHAMPION={CHAMPION} is not one of the deployed versions {list(MODELS)}')
+
+    shadow_version = os.getenv('SCORE_SHADOW')
+    if shadow_version and shadow_version not in MODELS:
+        raise Exception(f'SCORE_SHADOW={shadow_version} is not one of the deployed versions {list(MODELS)}')
+    if shadow_version and shadow_version != CHAMPION:
+        SHADOW = models.Shadow(
+            shadow_version,
+            MODELS[shadow_version].predict_uncached,
+            int(os.getenv('SCORE_SHADOW_QUEUE', '1000'))
+        )
+        print(f'Shadowing version {CHAMPION} with version {shadow_version}')
+    print(f'Serving versions {list(MODELS)}, {CHAMPION} by default')
+
+    # Warm up with a prediction on the sample input, so the first real request doesn't pay
+    # for lazy imports, first-call allocations, or starting the batcher thread
+    for version in MODELS:
+        start = time.perf_counter()
+        predict(VALIDATOR(input_sample), version)
+        print(f'Warm-up prediction of version {version} took {(time.perf_counter() - start) * 1000:.1f}ms')
+
+    READY = True
+
+
+def _load_model(version: str, model_folder: str, previous: models.ServedModel = None) -> models.ServedModel:
+    compiled_path = os.path.join(model_folder, compiled_model.FILE_NAME)
+
+    # SCORE_PRECISION=float32 serves its float32 copy instead, with half the memory.
+    # It's only registered if its predictions matched the model's at evaluation, so fall back when it's missing
+    if os.getenv('SCORE_PRECISION', 'float64') == 'float32':
+        float32_path = os.path.join(model_folder, compiled_model.FLOAT32_FILE_NAME)
+        if os.path.exists(float32_path):
+            compiled_path = float32_path
+        else:
+            print(f'No float32 model in {model_folder}, serving the full-precision one')
+
+    # Prefer the NumPy-only compiled model (see `lib/pipeline/compiled.py`), it starts and predicts faster.
+    # Older model versions don't have one, and SCORE_ENGINE=sklearn forces the pickled sklearn model
+    if os.path.exists(compiled_path) and os.getenv('SCORE_ENGINE', 'compiled') != 'sklearn':
+        # memory-mapped by default, so the server's worker processes (WORKER_COUNT) share one copy of the model
+        model = compiled_model.CompiledSVC.load(compiled_path, mmap=os.getenv('SCORE_MMAP', '1') == '1')
+        print(f'Compiled model predicts in {model.dtype}')
+    else:
+        # only import joblib (and sklearn, when unpickling) if we need it
+        import joblib
+        # Deserialize the model file back into a sklearn model.
+        model = joblib.load(os.path.join(model_folder, 'model.pkl'))
+    print(f'Loaded model {type(model).__name__} version {version} from {model_folder}')
+
+    # The scaler fitted by the clean stage (see `lib/pipeline/clean/clean.py`), applied to the raw inputs.
+    # Older model versions were trained on data that was scaled beforehand, and don't have one
+    scaler_path = os.path.join(model_folder, scaling.FILE_NAME)
+    scaler = scaling.Standardizer.load(scaler_path) if os.path.exists(scaler_path) else None
+    print(f'Inputs are {"scaled by the model" if scaler is not None else "expected to be scaled already"}')
+
+    cache = None
+    cache_size = int(os.getenv('SCORE_CACHE_SIZE', '0'))
+    if cache_size > 0:
+        # the same version is the same model, keep its predictions across reloads
+        if previous is not None and previous.cache is not None and previous.cache.max_size == cache_size:
+            cache = previous.cache
+        else:
+            cache = PredictionCache(cache_size, version)
+
+    pool = None
+    processes = int(os.getenv('SCORE_PROCESSES', '0'))
+    if processes > 0 and isinstance(model, compiled_model.CompiledSVC):
+        pool = PredictPool(model.predict, compiled_path, processes, int(os.getenv('SCORE_POOL_MIN_ROWS', '256')))
+        pool.warm_up(VALIDATOR(input_sample))
+        print(f'Splitting batches of {pool.min_rows}+ rows across {processes} worker processes')
+    elif processes > 0:
+        print('SCORE_PROCESSES needs the compiled model, predicting in this process')
+
+    batcher = None
+    if os.getenv('SCORE_BATCHING', '0') == '1':
+        batcher = MicroBatcher(
+            pool.predict if pool is not None else model.predict,
+            max_batch_size=int(os.getenv('SCORE_MAX_BATCH_SIZE', '64')),
+            max_wait_ms=float(os.getenv('SCORE_MAX_WAIT_MS', '5'))
+        )
+
+    return models.ServedModel(version, model, scaler, cache, pool, batcher)
 
 '''
-SAMPLE JSON:
-
-{'texture_mean': 0.8432786469399629,
- 'smoothness_mean': 0.2523641398103375,
- 'compactness_mean': 2.3583159827998363,
- 'concavity_mean': 2.531619520072832,
- 'concave points_mean': 1.450069508719469,
- 'symmetry_mean': 0.8703875539174302,
- 'fractal_dimension_mean': 0.9008419873112651,
- 'radius_se': -0.5387860955897966,
- 'texture_se': -0.6053635175011898,
- 'perimeter_se': 0.39563104081988226,
- 'area_se': -0.3250993411860726,
- 'smoothness_se': -0.029234593660855363,
- 'compactness_se': 2.031565539613105,
- 'concavity_se': 1.505019516553444,
- 'concave points_se': 1.7980670710827722,
- 'symmetry_se': -0.6809728679517403,
- 'fractal_dimension_se': 0.7246074237668291,
- 'texture_worst': 0.3718226142066996,
- 'perimeter_worst': 0.6937804113864807,
- 'area_worst': 0.018073841227546305,
- 'smoothness_worst': 0.4187939453648082,
- 'compactness_worst': 2.986439651446995,
- 'concavity_worst': 3.208749505160136,
- 'concave points_worst': 2.2127117293244543,
- 'symmetry_worst': -0.06072067452440019,
- 'fractal_dimension_worst': 1.816145326154702}
+SAMPLE JSON (raw measurements, the model's scaler is applied in `predict()`):
+
+{'texture_mean': 12.6896,
+ 'smoothness_mean': 0.0738959,
+ 'compactness_mean': 0.0376202,
+ 'concavity_mean': 0.00353601,
+ 'concave points_mean': 0.0095522,
+ 'symmetry_mean': 0.161025,
+ 'fractal_dimension_mean': 0.0600093,
+ 'radius_se': 0.32485,
+ 'texture_se': 1.46882,
+ 'perimeter_se': 2.06642,
+ 'area_se': 23.5434,
+ 'smoothness_se': 0.0102817,
+ 'compactness_se': 0.00976304,
+ 'concavity_se': 0.00580055,
+ 'concave points_se': 0.00776846,
+ 'symmetry_se': 0.028231,
+ 'fractal_dimension_se': 0.00466249,
+ 'texture_worst': 16.2265,
+ 'perimeter_worst': 81.4446,
+ 'area_worst': 502.286,
+ 'smoothness_worst': 0.0940078,
+ 'compactness_worst': 0.0545042,
+ 'concavity_worst': 9.41053e-05,
+ 'concave points_worst': 0.0235395,
+ 'symmetry_worst': 0.228277,
+ 'fractal_dimension_worst': 0.0696499}
 '''
 
-# this is gotten from the `X_test` variable
-input_sample = np.array([[-1.53587537, -1.59868622, -1.2644576 , -1.07047828, -1.01543024,
-       -0.73519693, -0.39527791, -0.28990047,  0.45715098, -0.39584766,
-       -0.36948983,  1.08027519, -0.87830952, -0.86517173, -0.65332827,
-        0.93093931,  0.32816649, -1.53899135, -0.76896925, -0.66501272,
-       -1.68158125, -1.27075786, -1.30537918, -1.38663635, -0.99976219,
-       -0.79221752]])
+# this is gotten from the `X_test` variable, before scaling
+input_sample = np.array([[
+    12.6896, 0.0738959, 0.0376202, 0.00353601, 0.0095522, 0.161025,
+    0.0600093, 0.32485, 1.46882, 2.06642, 23.5434, 0.0102817,
+    0.00976304, 0.00580055, 0.00776846, 0.028231, 0.00466249, 16.2265,
+    81.4446, 502.286, 0.0940078, 0.0545042, 9.41053e-05, 0.0235395,
+    0.228277, 0.0696499,
+]])
 output_sample = np.array([1])
 
 
+def _route(version: str = None) -> models.ServedModel:
+    if version is None:
+        return MODELS[CHAMPION]
+    try:
+        return MODELS[str(version)]
+    except KeyError:
+        raise validation.ValidationError([
+            {'error': f'Unknown model version {version!r}, expected one of {list(MODELS)}'}
+        ]) from None
+
+
+def predict(data: np.ndarray, version: str = None) -> list:
+    trace = instrumentation.current()
+    trace.mark('parse')
+    trace.rows = len(data)
+
+    served = _route(version)
+    result = served.predict(data)
+    # only requests to the champion are shadowed, the others asked for a version on purpose
+    if SHADOW is not None and version is None:
+        SHADOW.submit(data, result)
+    trace.mark('predict')
+
+    # You can return any JSON-serializable object.
+    result = result.tolist()
+    trace.mark('serialize')
+    return result
+
+
+# Requests are validated by `VALIDATOR` instead, this only describes the default JSON format (`GET /score?schema`)
 @input_schema('data', NumpyParameterType(input_sample))
 @output_schema(NumpyParameterType(output_sample))
-def run(data):
+def predict_json(data):
+    return predict(VALIDATOR(data))
+
+
+# We take the raw request, instead of letting `inference_schema` parse it,
+# so we can accept more than the default JSON format. See `payloads.py`
+@rawhttp
+def run(request: AMLRequest):
+    # readiness probe, see `post_deployment()` in `lib/deploy_helpers.py`
+    if request.method == 'GET':
+        if METRICS is not None and 'metrics' in request.args:
+            metrics = METRICS.render() + (SHADOW.render() if SHADOW is not None else '')
+            return AMLResponse(metrics, 200, {'Content-Type': instrumentation.CONTENT_TYPE})
+        if METRICS is not None and 'traces' in request.args:
+            return {'traces': METRICS.traces()}
+        if 'schema' in request.args:
+            return {'input': get_input_schema(predict_json), 'output': get_output_schema(predict_json)}
+        return {
+            'ready': READY,
+            'champion': CHAMPION if READY else None,
+            'models': {version: served.describe() for version, served in MODELS.items()} if READY else None,
+            'shadow': SHADOW.stats() if SHADOW is not None else None,
+        }
+
+    trace = METRICS.start() if METRICS is not None else None
     try:
-        result = MODEL.predict(data)
-        # You can return any JSON-serializable object.
-        return result.tolist()
+        try:
+            data, version = payloads.decode(request.get_data(cache=False), request.headers.get('Content-Type', ''))
+        except ValueError as err:
+            raise validation.ValidationError([{'error': str(err)}]) from err
+        # the header wins over the payload field, so a proxy can route requests without rewriting their bodies
+        version = request.headers.get(models.VERSION_HEADER) or version
+        return predict(VALIDATOR(data), version)
+    except validation.ValidationError as e:
+        if trace is not None:
+            trace.error = type(e).__name__
+        # which rows are wrong and why, see `validation.py`
+        return AMLResponse(e.to_dict(), 400, json_str=True)
     except Exception as e:
+        if trace is not None:
+            trace.error = type(e).__name__
         error = str(e)
         return error
+    finally:
+        if trace is not None:
+            METRICS.finish(trace)
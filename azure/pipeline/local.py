@@ -0,0 +1,212 @@
+# runs the prep-clean-train-evaluate-register pipeline locally, in this process
+# same steps as `main.py`, but against a local mlflow file store instead of Azure
+
+# relative imports from lib/
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import mlflow
+
+import constants
+import pipeline
+from pipeline import metrics
+
+ROOT = Path(__file__).resolve().parents[2]
+PIPELINE_DIR = ROOT / 'lib' / 'pipeline'
+
+# the shared modules in `lib/pipeline` every stage can import (constants.py, metrics.py, ...)
+SHARED_SOURCES = sorted(PIPELINE_DIR.glob('*.py'))
+
+
+def hash_path(path: Path) -> str:
+    '''SHA-256 over the relative paths and contents of a file, or of every file in a folder'''
+    path = Path(path)
+    files = [path] if path.is_file() else sorted(f for f in path.rglob('*') if f.is_file())
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(file.relative_to(path.parent if path.is_file() else path).as_posix().encode())
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hash(stage: str) -> str:
+    '''Hash of the code a stage runs: its own folder in `lib/pipeline`, and the shared modules'''
+    digest = hashlib.sha256()
+    for path in SHARED_SOURCES + sorted((PIPELINE_DIR / stage).rglob('*.py')):
+        digest.update(path.relative_to(PIPELINE_DIR).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class StepOutputs(dict):
+    '''The output folders of a step, and the cache key they were made with'''
+
+    def __init__(self, key: str, folders: dict):
+        super().__init__(folders)
+        self.key = key
+
+
+class LocalRunner:
+    '''
+    Runs pipeline stages one after the other, caching each step's outputs
+    under `cache_dir/<stage>/<key>`, where the key is a hash of:
+    - the stage's source code (see `source_hash()`)
+    - its parameters
+    - its inputs: the contents of input files, or the keys of the upstream steps that made them.
+      Inputs are either paths, or `(step outputs, output name)` tuples
+
+    A step whose key is already cached isn't run again.
+    '''
+
+    def __init__(self, cache_dir: Path, force=()):
+        self.cache_dir = Path(cache_dir)
+        self.force = set(force)
+        # once a step re-runs because it was forced, its outputs may differ under the same key,
+        # so every step after it has to re-run too
+        self.forcing = False
+        self.summary = []
+
+    def step(self, stage: str, inputs: dict, outputs: list, params: dict = None) -> StepOutputs:
+        params = params or {}
+        digest = hashlib.sha256(stage.encode())
+        digest.update(source_hash(stage).encode())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for name, value in sorted(inputs.items()):
+            digest.update(name.encode())
+            digest.update((value[0].key if isinstance(value, tuple) else hash_path(value)).encode())
+        key = digest.hexdigest()[:16]
+
+        folder = self.cache_dir / stage / key
+        folders = {name: folder / name for name in outputs}
+        self.forcing = self.forcing or stage in self.force
+
+        if folder.exists() and not self.forcing:
+            print(f'==== {stage}: cached ({key}) ====')
+            self.summary.append((stage, key, 'cached', 0.0))
+            return StepOutputs(key, folders)
+
+        print(f'==== {stage}: running ({key}) ====')
+        # run into a temporary folder, so an interrupted step is never mistaken for a cached one
+        tmp = folder.with_name(f'{key}.tmp')
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        for name in outputs:
+            (tmp / name).mkdir(parents=True)
+        # anything a stage leaves in the working directory is kept with the step's outputs
+        work_dir = tmp / '_work'
+        work_dir.mkdir()
+
+        arguments = {
+            name: str(value[0][value[1]] if isinstance(value, tuple) else value) for name, value in inputs.items()
+        }
+        arguments.update({name: str(tmp / name) for name in outputs})
+
+        start = time.perf_counter()
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            pipeline.load_stage(stage)(**arguments, **params)
+        finally:
+            os.chdir(cwd)
+            # `register` doesn't end its run
+            metrics.end()
+            while mlflow.active_run() is not None:
+                mlflow.end_run()
+        elapsed = time.perf_counter() - start
+
+        if folder.exists():
+            shutil.rmtree(folder)
+        tmp.rename(folder)
+        self.summary.append((stage, key, 'ran', elapsed))
+        return StepOutputs(key, folders)
+
+
+def run(raw_data: Path, cache_dir: Path, force=(), streaming=False, method='iqr', search='none', candidates='none',
+        engine='svc') -> dict:
+    '''The same steps as `wisconsin_bca_pipeline()` in `main.py`'''
+    runner = LocalRunner(cache_dir, force)
+
+    prep = runner.step(
+        'prep',
+        inputs={'raw_data': raw_data},
+        outputs=['train_data', 'val_data', 'test_data'],
+        params={'streaming': streaming}
+    )
+    clean = runner.step(
+        'clean',
+        inputs={
+            'train_data': (prep, 'train_data'),
+            'val_data': (prep, 'val_data'),
+            'test_data': (prep, 'test_data'),
+        },
+        outputs=['clean_train_data', 'clean_val_data', 'clean_test_data', 'scaler_output'],
+        params={'method': method}
+    )
+    train = runner.step(
+        'train',
+        inputs={'train_data': (clean, 'clean_train_data'), 'scaler': (clean, 'scaler_output')},
+        outputs=['model_output'],
+        params={'search': search, 'candidates': candidates, 'engine': engine}
+    )
+    evaluate = runner.step(
+        'evaluate',
+        inputs={
+            'model_input': (train, 'model_output'),
+            'test_data': (clean, 'clean_test_data'),
+            'raw_test_data': (prep, 'test_data'),
+        },
+        outputs=['evaluation_output'],
+        params={'model_name': constants.MODEL_NAME}
+    )
+    register = runner.step(
+        'register',
+        inputs={'model_path': (train, 'model_output'), 'evaluation_output': (evaluate, 'evaluation_output')},
+        outputs=['model_info_output_path'],
+        params={'model_name': constants.MODEL_NAME}
+    )
+
+    print('\nStep       Key               Status   Time')
+    for stage, key, status, elapsed in runner.summary:
+        print(f'{stage:<10} {key:<17} {status:<8} {elapsed:.1f}s')
+    return {'model': train['model_output'], 'evaluation': evaluate['evaluation_output'],
+            'model_info': register['model_info_output_path']}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Runs the ML pipeline locally, skipping steps that are cached')
+    parser.add_argument('--data', type=Path, default=ROOT / 'data' / 'cleaned-wisconsin-lof.parquet',
+                        help='raw parquet file (or folder) to run the pipeline on')
+    parser.add_argument('--cache-dir', type=Path, default=ROOT / '.azure-tmp' / 'pipeline',
+                        help='where step outputs are cached')
+    parser.add_argument('--tracking-uri', help='mlflow tracking URI (default: a file store in the cache dir)')
+    parser.add_argument('--force', default='', help='comma-separated steps to re-run (along with every step after them)')
+    parser.add_argument('--streaming', action='store_true', help='prep: split the raw data in batches')
+    parser.add_argument('--method', default='iqr', help="clean: outlier method, 'iqr', 'lof' or 'none'")
+    parser.add_argument('--search', default='none', help="train: 'none', 'grid' or 'random' hyperparameter search")
+    parser.add_argument('--engine', default='svc', help="train: 'svc', or 'nystroem' for the approximate-kernel engine")
+    parser.add_argument('--candidates', default='none', help="train: 'none', 'all' or comma-separated model families")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    # newer mlflow versions want an explicit opt-in for the file store
+    os.environ.setdefault('MLFLOW_ALLOW_FILE_STORE', 'true')
+    mlflow.set_tracking_uri(args.tracking_uri or (args.cache_dir.resolve() / 'mlruns').as_uri())
+    mlflow.set_experiment(constants.EXPERIMENT_NAME)
+
+    outputs = run(
+        args.data.resolve(), args.cache_dir.resolve(),
+        force=[stage for stage in args.force.split(',') if stage],
+        streaming=args.streaming, method=args.method, search=args.search, candidates=args.candidates,
+        engine=args.engine
+    )
+    print(json.dumps({name: str(path) for name, path in outputs.items()}, indent=2))
@@ -1,5 +1,6 @@
 # runs the prep-train-evaluate-register pipeline in Azure
 # imports components from `lib/pipeline`
+# with `INCREMENTAL_PREP=1`, prep only splits the raw files added since the last run (see `README.md`)
 
 # relative imports from lib/deploy_helpers.py
 import os
@@ -12,6 +13,8 @@ from azure.ai.ml import Input
 from azure.ai.ml.dsl import pipeline
 from azure.ai.ml.constants import AssetTypes
 
+INCREMENTAL_PREP = os.getenv('INCREMENTAL_PREP', '0') == '1'
+
 # define a pipeline
 @pipeline(
     default_compute='cpu-cluster',
@@ -20,12 +23,30 @@ def wisconsin_bca_pipeline(input_data):
     '''
     E2E ML pipeline using the Wisconsin BCa Dataset
     '''
-    prep_node = components.prep(raw_data=input_data)
-    train_node = components.train(train_data=prep_node.outputs.train_data)
+    if INCREMENTAL_PREP:
+        # only splits the raw files added since the last run, see `lib/pipeline/prep/README.md`
+        prep_node = components.prep_incremental(raw_data=input_data)
+        # which needs the previous run's partitions and `_watermark.json`, so the splits go to the same paths every run
+        for name in ('train_data', 'val_data', 'test_data'):
+            output = getattr(prep_node.outputs, name)
+            output.path = f'{constants.PREP_OUTPUT_PATH}/{name}/'
+            output.mode = 'rw_mount'
+    else:
+        prep_node = components.prep(raw_data=input_data)
+    clean_node = components.clean(
+        train_data=prep_node.outputs.train_data,
+        val_data=prep_node.outputs.val_data,
+        test_data=prep_node.outputs.test_data
+    )
+    train_node = components.train(
+        train_data=clean_node.outputs.clean_train_data,
+        scaler=clean_node.outputs.scaler_output
+    )
 
     evaluate_node = components.evaluate(
         model_input=train_node.outputs.model_output,
-        test_data=prep_node.outputs.test_data
+        test_data=clean_node.outputs.clean_test_data,
+        raw_test_data=prep_node.outputs.test_data
     )
 
     register_node = components.register(
@@ -37,7 +58,11 @@ def wisconsin_bca_pipeline(input_data):
 # ref: https://learn.microsoft.com/en-us/azure/machine-learning/how-to-create-component-pipeline-python?view=azureml-api-2
 if __name__ == '__main__':
     # create a pipeline
-    wisconsin_bca_dataset = Input(type=AssetTypes.URI_FILE, path='azureml:wisconsin-bca-data:1')
+    if INCREMENTAL_PREP:
+        # a folder of raw parquet files, new cases are added to it as new files
+        wisconsin_bca_dataset = Input(type=AssetTypes.URI_FOLDER, path=constants.RAW_DATA_PATH)
+    else:
+        wisconsin_bca_dataset = Input(type=AssetTypes.URI_FILE, path='azureml:wisconsin-bca-data:1')
     print('Dataset:', wisconsin_bca_dataset)
     pipeline = wisconsin_bca_pipeline(input_data=wisconsin_bca_dataset)
 
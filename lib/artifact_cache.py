@@ -0,0 +1,94 @@
+'''
+# ARTIFACT CACHE
+
+A local cache of downloaded model versions, so local endpoint tests don't re-download
+a model version that is already on disk.
+
+Each cached version is recorded in `index.json` with the SHA-256 of its files. Azure doesn't give us
+a content hash before downloading, so the hash is computed after the first download, and checked
+again on every cache hit so a modified or half-deleted folder gets re-downloaded instead of deployed.
+When the cache grows past `max_bytes`, the least recently used versions are deleted.
+'''
+import hashlib
+import json
+import shutil
+import time
+from pathlib import Path
+
+from azure.ai.ml import MLClient
+
+CACHE_DIR = Path('.azure-tmp') / 'models'
+# the model is a few MB, this keeps plenty of versions around
+MAX_BYTES = 1024 ** 3
+
+
+def get_model(mlclient: MLClient, name: str, version: str, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES) -> Path:
+    '''
+    Returns the folder the model version was downloaded to, downloading it only if it isn't already cached
+    '''
+    cache_dir = Path(cache_dir)
+    index = _load_index(cache_dir)
+    key = f'{name}:{version}'
+    target = cache_dir / name / version
+
+    entry = index.get(key)
+    if entry is not None:
+        if target.is_dir() and _content_hash(target) == entry['sha256']:
+            print(f'Model {key} found in local cache at {target}, skipping download')
+            entry['last_used'] = time.time()
+            _save_index(cache_dir, index)
+            return target
+        print(f'Cached model {key} failed its integrity check, downloading it again')
+
+    if target.exists():
+        shutil.rmtree(target)
+    target.mkdir(parents=True)
+    print(f'Downloading model {key} to {target}')
+    mlclient.models.download(name, version, download_path=str(target))
+
+    index[key] = {
+        'path': str(target),
+        'sha256': _content_hash(target),
+        'size': sum(f.stat().st_size for f in target.rglob('*') if f.is_file()),
+        'last_used': time.time(),
+    }
+    _evict(index, max_bytes, keep=key)
+    _save_index(cache_dir, index)
+    return target
+
+
+def _content_hash(folder: Path) -> str:
+    '''SHA-256 over the relative paths and contents of every file in `folder`'''
+    digest = hashlib.sha256()
+    for path in sorted(f for f in folder.rglob('*') if f.is_file()):
+        digest.update(path.relative_to(folder).as_posix().encode())
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _evict(index: dict, max_bytes: int, keep: str):
+    '''Deletes least recently used versions (except `keep`) until the cache fits in `max_bytes`'''
+    total = sum(entry['size'] for entry in index.values())
+    for key, entry in sorted(index.items(), key=lambda item: item[1]['last_used']):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        print(f'Evicting cached model {key} ({entry["size"]} bytes)')
+        shutil.rmtree(entry['path'], ignore_errors=True)
+        total -= entry['size']
+        del index[key]
+
+
+def _load_index(cache_dir: Path) -> dict:
+    try:
+        return json.loads((cache_dir / 'index.json').read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_index(cache_dir: Path, index: dict):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / 'index.json').write_text(json.dumps(index, indent=2))
@@ -8,3 +8,9 @@ ENV_NAME='wisconsin-bca-env'
 
 CPU_CLUSTER_TARGET='cpu-cluster'
 EXPERIMENT_NAME='wisconsin-bca'
+
+# with `INCREMENTAL_PREP=1`, raw data is a datastore folder that new parquet files of cases are added to,
+# see `azure/pipeline/README.md`
+RAW_DATA_PATH='azureml://datastores/workspaceblobstore/paths/wisconsin-bca/raw/'
+# the prep splits are kept at fixed paths, so each run only splits the raw files added since the last one
+PREP_OUTPUT_PATH='azureml://datastores/workspaceblobstore/paths/wisconsin-bca/prep'
@@ -4,10 +4,16 @@
 A collection of helper functions to manage deploying a model to an Azure managed endpoint.
 Supports both local and remote endpoints.
 '''
+import json
 import os
+import shutil
 import time
 import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+import artifact_cache
 import constants
 
 from azure.ai.ml import MLClient
@@ -17,11 +23,23 @@ from azure.ai.ml.entities import (
     ManagedOnlineDeployment,
     Model,
     Environment,
-    CodeConfiguration
+    CodeConfiguration,
+    OnlineRequestSettings
 )
 from azure.ai.ml.exceptions import LocalEndpointInFailedStateError
 from azure.identity import AzureCliCredential
 
+# seconds spent in each phase of a deploy, see `timed()` and `print_timings()`
+TIMINGS: dict[str, float] = {}
+
+# vCPUs of the instance types we deploy to, we run a scoring worker process per core
+# https://learn.microsoft.com/en-us/azure/machine-learning/reference-managed-online-endpoints-vm-sku-list?view=azureml-api-2
+INSTANCE_CORES = {
+    'Standard_DS2_v2': 2,
+    'Standard_DS3_v2': 4,
+    'Standard_F4s_v2': 4,
+}
+
 
 def get_envs() -> tuple[str, str, str]:
     '''
@@ -77,21 +95,38 @@ def get_latest_model(mlclient: MLClient, local: bool) -> Model:
     )
 
     if local:
-        mlclient.models.download(
-            constants.MODEL_NAME, 
-            str(latest_model_version), 
-            download_path='.azure-tmp'
-        )
+        # only downloads the model if this version isn't in `.azure-tmp/models` already
+        download_path = artifact_cache.get_model(mlclient, constants.MODEL_NAME, str(latest_model_version))
         # Not sure why our model has a nested folder for `wisconsin-BCa-model` lol
         # still, we need to specify exactly this path, or we will have inconsistencies 
         # between local and remote
-        return Model(path='.azure-tmp/wisconsin-BCa-model/wisconsin-BCa-model')
+        return Model(path=str(download_path / constants.MODEL_NAME / constants.MODEL_NAME))
 
     model = mlclient.models.get(name=constants.MODEL_NAME, version=str(latest_model_version))
     print(f'Got model {model.name} with version {model.version}')
     return model
 
 
+def get_cohosted_model(mlclient: MLClient, versions: list[str], output_dir='.azure-tmp/cohosted') -> Model:
+    '''
+    Returns a model folder holding several versions of the model (wisconsin-bca-model),
+    laid out as `<version>/wisconsin-BCa-model` so `score.py` loads (and routes between) all of them.
+    See `azure/deploy/models.py`
+    '''
+    target = os.path.join(output_dir, '-'.join(versions))
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    for version in versions:
+        # only downloads the versions that aren't in `.azure-tmp/models` already
+        download_path = artifact_cache.get_model(mlclient, constants.MODEL_NAME, version)
+        shutil.copytree(
+            download_path / constants.MODEL_NAME / constants.MODEL_NAME,
+            os.path.join(target, version, constants.MODEL_NAME)
+        )
+    print(f'Co-hosting model versions {versions} from {target}')
+    return Model(path=target)
+
+
 def ml_environment(mlclient: MLClient, local: bool, localName='local') -> Environment:
     '''
     Gets an environment object for the model
@@ -155,18 +190,60 @@ def create_or_update_endpoint(mlclient: MLClient, local: bool) -> OnlineEndpoint
             return endpoint
 
 
+def resolve_resources(mlclient: MLClient, local: bool) -> tuple[Model, Environment, OnlineEndpoint]:
+    '''
+    Gets the latest model and environment, and creates (or gets) the endpoint, all at the same time.
+
+    These are independent remote calls, and creating an endpoint can take minutes,
+    so we start the endpoint first and look up the model and environment while it's being created.
+    Only uses `mlclient` through the functions above, so any object shaped like an `MLClient`
+    (e.g. a fake one with artificial latencies, see `tests/deploy`) works too.
+    '''
+    def run_timed(phase, func):
+        with timed(phase):
+            return func(mlclient, local)
+
+    with timed('resolve_resources'), ThreadPoolExecutor(max_workers=3) as pool:
+        endpoint = pool.submit(run_timed, 'create_or_update_endpoint', create_or_update_endpoint)
+        model = pool.submit(run_timed, 'get_latest_model', get_latest_model)
+        environment = pool.submit(run_timed, 'ml_environment', ml_environment)
+
+        return model.result(), environment.result(), endpoint.result()
+
+
+@contextmanager
+def timed(phase: str):
+    '''
+    Records how long the `with` block took in `TIMINGS[phase]`
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS[phase] = time.perf_counter() - start
+
+
+def print_timings():
+    print('\n\n***DEPLOY TIMINGS***')
+    for phase, seconds in TIMINGS.items():
+        print(f'{phase}: {seconds:.1f}s')
+    print()
+
+
 def create_or_update_deployment(
         mlclient: MLClient, 
         model: Model,
         env: Environment,
         endpoint: OnlineEndpoint,
-        local: bool
+        local: bool,
+        environment_variables: dict[str, str] = None
     ) -> str:
     '''
     Creates model deployment if it doesn't exist, else updates it. 
     Returns the deployment name to be used later on
 
-    If `local=True`, we use local docker deployments
+    If `local=True`, we use local docker deployments.
+    `environment_variables` configure the scoring script, see `azure/deploy/README.md`
 
     I kind of (?) use blue-green deployments here, but I'm not sure if it's the right way to do it
     https://docs.cloudfoundry.org/devguide/deploy-apps/blue-green.html
@@ -183,6 +260,10 @@ def create_or_update_deployment(
         else:
             deployment_name, instance_type = 'blue', "Standard_DS2_v2"
 
+    # The inference server runs WORKER_COUNT worker processes, each calling `init()` in `score.py`.
+    # The compiled model is memory-mapped, so they share one copy of it (see `azure/deploy/README.md`)
+    workers = INSTANCE_CORES.get(instance_type, 1)
+
     # define an online deployment
     deployment = ManagedOnlineDeployment(
         name=deployment_name,
@@ -193,6 +274,9 @@ def create_or_update_deployment(
         # https://learn.microsoft.com/en-us/azure/machine-learning/reference-managed-online-endpoints-vm-sku-list?view=azureml-api-2
         instance_type=instance_type,
         instance_count=1,
+        environment_variables={'WORKER_COUNT': str(workers), **(environment_variables or {})},
+        # by default only one request at a time is sent to an instance, which would leave the other workers idle
+        request_settings=OnlineRequestSettings(max_concurrent_requests_per_instance=workers),
         code_configuration=CodeConfiguration(
             code='azure/deploy',
             scoring_script='score.py'
@@ -215,9 +299,12 @@ def create_or_update_deployment(
     return deployment_name
 
 
-def post_deployment(mlclient: MLClient, deployment_name: str, local: bool):
+def post_deployment(mlclient: MLClient, deployment_name: str, local: bool, ready_timeout=600):
     '''
     Running some checks and printing some metadata after the endpoint has been deployed
+
+    Waits (up to `ready_timeout` seconds) for the scoring script to report it's ready before
+    sending test predictions
     '''
     # check deployment
     endpoint = mlclient.online_endpoints.get(name=constants.ENDPOINT_NAME, local=local)
@@ -230,53 +317,104 @@ def post_deployment(mlclient: MLClient, deployment_name: str, local: bool):
     print(f'State: {endpoint.provisioning_state}\n\n')
 
 
-    while True:
-        try:
-            success = _predict_at_endpoint(mlclient, local)
-            if success:
-                break
-
-            time.sleep(2)
-        except LocalEndpointInFailedStateError:
-            print('Endpoint is in a failed state! Printing logs')
-            _print_logs(mlclient, local, deployment_name)
-            sys.exit(1)
-        except Exception as err:
-            print(f'Unknown error: {err}')
-            sys.exit(1)
+    try:
+        # wait for `init()` in the scoring script to finish loading and warming up the model
+        _wait_with_backoff(
+            lambda: _endpoint_ready(mlclient, endpoint.scoring_uri, deployment_name, local),
+            timeout=ready_timeout
+        )
+        # the endpoint is ready, so this should pass on the first try
+        _wait_with_backoff(lambda: _predict_at_endpoint(mlclient, local), timeout=60)
+    except LocalEndpointInFailedStateError:
+        print('Endpoint is in a failed state! Printing logs')
+        _print_logs(mlclient, local, deployment_name)
+        sys.exit(1)
+    except TimeoutError as err:
+        print(f'{err}! Printing logs')
+        _print_logs(mlclient, local, deployment_name)
+        sys.exit(1)
+    except Exception as err:
+        print(f'Unknown error: {err}')
+        sys.exit(1)
 
     print('Endpoint creation and testing success!')
     _print_logs(mlclient, local, deployment_name)
 
 
+def _wait_with_backoff(check, timeout: float, initial_delay=1.0, max_delay=30.0):
+    '''
+    Calls `check()` until it returns `True`, sleeping with exponential backoff in between
+    (`initial_delay`, doubling up to `max_delay` seconds).
+    Raises a `TimeoutError` if `check()` hasn't passed after `timeout` seconds
+    '''
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while not check():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f'Endpoint was not ready after {timeout}s')
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def _endpoint_ready(mlclient: MLClient, scoring_uri: str, deployment_name: str, local: bool) -> bool:
+    '''
+    Sends a GET request to the scoring URI, which `run()` in `azure/deploy/score.py` answers with
+    `{"ready": true}` once the model is loaded and warmed up.
+    Connection errors and 502s mean the container isn't up yet, so they count as not ready
+    '''
+    headers = {}
+    if not local:
+        key = mlclient.online_endpoints.get_keys(name=constants.ENDPOINT_NAME).primary_key
+        headers['Authorization'] = f'Bearer {key}'
+        # ask for the new deployment specifically, in case traffic hasn't moved over to it
+        headers['azureml-model-deployment'] = deployment_name
+
+    request = urllib.request.Request(scoring_uri, headers=headers, method='GET')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            status = json.loads(response.read())
+    except (OSError, ValueError) as err:
+        # `urllib.error.URLError` (and `HTTPError`) are `OSError`s, bad JSON is a `ValueError`
+        print(f'Endpoint not ready yet ({err}), retrying...')
+        return False
+
+    print(f'Readiness: {status}')
+    return bool(status.get('ready')) if isinstance(status, dict) else False
+
+
 def _predict_at_endpoint(mlclient: MLClient, local: bool) -> bool:
     '''
     Passing hardcoded data to the endpoint to test it out. 
     Returns `true` if the prediction is expected, `false` if we need to retry
-    Retries happen when the endpoint is not ready to receive requests yet (502 Bad Gateway error)
+    Retries happen when the endpoint is not ready to receive requests yet (502 Bad Gateway error),
+    which shouldn't happen anymore once `_endpoint_ready()` passes
+
+    The same two rows are sent both as JSON arrays and as JSON records (see `azure/deploy/payloads.py`)
 
     Reference: https://learn.microsoft.com/en-us/azure/machine-learning/how-to-deploy-online-endpoints?view=azureml-api-2&tabs=python#invoke-the-local-endpoint-to-score-data-by-using-your-model
     '''
-    prediction = mlclient.online_endpoints.invoke(
-        endpoint_name=constants.ENDPOINT_NAME,
-        request_file='tests/endpoint/sample_data.json',
-        local=local
-    )
-    print(f'*** Prediction: {prediction}')
-    if "502 Bad Gateway" in prediction:
-         # What's weird is that the first few requests to the endpoint usually fail
-        # with a 502 Bad Gateway error (at least on local deployments)
-        # I feel like there should be a way to check if the endpoint is ready to receive requests,
-        # but I couldn't find anything
-        # In the endpoint metadata (post_deployment function), it always shows the state as "succeeded"
-        print('Bad gateway error, retrying...')
-        return False
-    elif prediction == "[0, 0]":
-        return True
-    else:
-        print('Unexpected prediction result! Expecting [0, 0]')
-        # exit with error
-        sys.exit(1)
+    for request_file in ['tests/endpoint/sample_data.json', 'tests/endpoint/sample_records.json']:
+        prediction = mlclient.online_endpoints.invoke(
+            endpoint_name=constants.ENDPOINT_NAME,
+            request_file=request_file,
+            local=local
+        )
+        print(f'*** Prediction ({request_file}): {prediction}')
+        if "502 Bad Gateway" in prediction:
+             # What's weird is that the first few requests to the endpoint usually fail
+            # with a 502 Bad Gateway error (at least on local deployments)
+            # I feel like there should be a way to check if the endpoint is ready to receive requests,
+            # but I couldn't find anything
+            # In the endpoint metadata (post_deployment function), it always shows the state as "succeeded"
+            print('Bad gateway error, retrying...')
+            return False
+        elif prediction != "[1, 0]":
+            print('Unexpected prediction result! Expecting [1, 0]')
+            # exit with error
+            sys.exit(1)
+
+    return True
 
 
 def _print_logs(mlclient: MLClient, local: bool, deployment_name: str):
@@ -1,7 +1,30 @@
 '''
 This module declares functions to be used as components in the Azure ML Pipeline
+
+The stages are imported lazily, by `load_stage('<stage>')`, so a component only pays for the
+imports of the stage it runs (e.g. `prep` never imports sklearn or matplotlib).
+See `tests/imports` for the import time of each component.
+
+Every stage function has the name of the subpackage it's in, and importing a subpackage binds it as
+an attribute of this package. So the stage functions are never attributes of this package themselves:
+`pipeline.<stage>` is always the subpackage, and `load_stage()` the way to get the stage function.
 '''
-from .evaluate import evaluate
-from .prep import prep
-from .register import register
-from .train import train
+import importlib
+
+# stage function -> the package it's in
+STAGES = {
+    'batch_score': 'batch_score',
+    'clean': 'clean',
+    'evaluate': 'evaluate',
+    'prep': 'prep',
+    'register': 'register',
+    'train': 'train',
+    'update': 'update',
+}
+
+__all__ = ['STAGES', 'load_stage']
+
+
+def load_stage(name: str):
+    '''Imports the stage `name`, and returns its function'''
+    return getattr(importlib.import_module(f'.{STAGES[name]}.{name}', __name__), name)
@@ -0,0 +1 @@
+from .batch_score import batch_score
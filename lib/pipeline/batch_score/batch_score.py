@@ -0,0 +1,249 @@
+'''
+Scores a large parquet input with a registered model, without going through the online endpoint
+
+The input (a parquet file, or a folder of them) is split into chunks of `row_groups_per_chunk` row groups,
+and the chunks are scored by `processes` worker processes. Each worker reads its own chunk straight from
+the input, scales it with the model's scaler, predicts with the compiled model (see `compiled.py`, memory-mapped
+so the workers share one copy of it) and writes the predictions and decision function values of the chunk
+to its own `part-<chunk>.parquet` in `predictions_output`. The parts are in input order, so the output
+folder reads as one dataset, with the input's id column (if it has one) to join the predictions back.
+
+Models without a compiled export (e.g. the `gradient_boosting` and `logistic_regression` candidates, see
+`train/candidates.py`) are scored with the mlflow sklearn model instead, every worker loading its own copy.
+Their parts have the `decision_function` of the model if it has one, or the `probability` of the positive class.
+
+Every part is written to a temporary file and renamed once complete, so a part that exists is a finished chunk.
+`_checkpoint.json` records the model, the input files (with their checksums, see `watermark.py`)
+and the chunking the parts were scored with: a job that was interrupted only scores the chunks it's missing
+when re-run on the same output, and starts over if any of those changed.
+'''
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import mlflow
+
+from .. import compiled, constants, metrics, scaling, watermark
+
+FEATURE_COLS = constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS
+CHECKPOINT_FILE = '_checkpoint.json'
+
+# the model and scaler of a worker process, loaded by `_init_worker()`
+_MODEL = None
+_SCALER = None
+
+
+def batch_score(model_name, input_data, predictions_output, model_input=None, processes=0, row_groups_per_chunk=1):
+    '''
+    Scores every row of `input_data` with `model_input` (the latest registered version of `model_name` by default),
+    writing the predictions to `predictions_output`. `processes=0` uses a process per core
+    '''
+    mlflow.start_run()
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_folder = resolve_model(model_name, model_input, tmp)
+        model_path = model_folder / compiled.FILE_NAME
+        if not model_path.exists():
+            print(f'{model_folder} has no {compiled.FILE_NAME}, scoring with the sklearn model')
+            model_path = model_folder
+        scaler_path = model_folder / scaling.FILE_NAME
+
+        output = Path(predictions_output)
+        output.mkdir(parents=True, exist_ok=True)
+        input_files = watermark.raw_files(input_data)
+        if not input_files:
+            raise ValueError(f'No parquet files found in {input_data}')
+        chunks = plan_chunks(input_files, row_groups_per_chunk)
+        metrics.log_param("model", str(model_input or model_name))
+        metrics.log_metric("chunks", len(chunks))
+
+        fingerprint = {
+            'model': _file_hash(model_path) if model_path.is_file() else _folder_hash(model_path),
+            'scaler': _file_hash(scaler_path) if scaler_path.exists() else None,
+            'files': {name: watermark.checksum(path) for name, path in input_files.items()},
+            'row_groups_per_chunk': row_groups_per_chunk,
+        }
+        done = resume(output, fingerprint)
+        todo = [chunk for chunk in chunks if chunk['part'] not in done]
+        print(f'{len(chunks) - len(todo)} of {len(chunks)} chunks already scored')
+        metrics.log_metric("chunks resumed", len(chunks) - len(todo))
+
+        processes = min(processes or os.cpu_count() or 1, max(len(todo), 1))
+        model_file = str(model_path)
+        scaler_file = str(scaler_path) if scaler_path.exists() else None
+        pool = None
+        if processes > 1:
+            # spawned rather than forked, mlflow may already be running threads (e.g. the batch logger's)
+            pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(model_file, scaler_file)
+            )
+            futures = [pool.submit(score_chunk, chunk, str(output)) for chunk in todo]
+            results = (future.result() for future in as_completed(futures))
+        else:
+            # not worth starting another process for
+            _init_worker(model_file, scaler_file)
+            results = (score_chunk(chunk, str(output)) for chunk in todo)
+
+        rows = 0
+        try:
+            for part, n_rows in results:
+                rows += n_rows
+                # only this process writes the checkpoint, as each chunk finishes
+                done.add(part)
+                save_checkpoint(output, fingerprint, done)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    print(f'Scored {rows} rows in {len(todo)} chunks with {processes} processes in {elapsed:.1f}s')
+    metrics.log_metric("rows scored", rows)
+    metrics.log_metric("rows per second", rows / elapsed if elapsed else 0.0)
+
+    metrics.end()
+    mlflow.end_run()
+
+
+def resolve_model(model_name, model_input, tmp) -> Path:
+    '''
+    The model folder to score with: `model_input` (a model folder, or a registered model holding one),
+    or the artifacts of the latest registered version of `model_name`, downloaded to `tmp`
+    '''
+    if model_input is None:
+        # only needed (with sklearn) when we aren't given the model to score with
+        from pipeline.update.update import latest_model_uri
+        model_input = mlflow.artifacts.download_artifacts(artifact_uri=latest_model_uri(model_name), dst_path=tmp)
+
+    folder = Path(model_input)
+    # registered models are a folder with the model folder in it, see `get_latest_model()` in `lib/deploy_helpers.py`
+    if not (folder / 'MLmodel').exists() and (folder / model_name).is_dir():
+        folder = folder / model_name
+    return folder
+
+
+def plan_chunks(input_files: dict, row_groups_per_chunk: int) -> list:
+    '''
+    Splits every input file into chunks of `row_groups_per_chunk` row groups, numbered in input order
+    '''
+    chunks = []
+    for name, path in input_files.items():
+        n_row_groups = pq.ParquetFile(path).num_row_groups
+        for first in range(0, n_row_groups, row_groups_per_chunk):
+            chunks.append({
+                'part': f'part-{len(chunks):05d}.parquet',
+                'file': name,
+                'path': str(path),
+                'row_groups': list(range(first, min(first + row_groups_per_chunk, n_row_groups))),
+            })
+    return chunks
+
+
+def resume(output: Path, fingerprint: dict) -> set:
+    '''
+    The parts already in `output` that were scored like `fingerprint` says we're about to.
+    If anything changed, the old parts are deleted and everything is scored again
+    '''
+    checkpoint = output / CHECKPOINT_FILE
+    try:
+        state = json.loads(checkpoint.read_text())
+    except FileNotFoundError:
+        state = None
+
+    if state is not None and state['fingerprint'] == fingerprint:
+        # a part in the checkpoint is complete, and so is one that was renamed into place just before an interruption
+        return {path.name for path in output.glob('part-*.parquet')}
+
+    if state is not None:
+        print('The model, input or chunking changed since the last run, scoring everything again')
+    for path in output.glob('part-*.parquet'):
+        path.unlink()
+    save_checkpoint(output, fingerprint, set())
+    return set()
+
+
+def save_checkpoint(output: Path, fingerprint: dict, done: set):
+    state = {'fingerprint': fingerprint, 'parts': sorted(done)}
+    tmp_path = output / f'{CHECKPOINT_FILE}.tmp'
+    tmp_path.write_text(json.dumps(state, indent=2))
+    os.replace(tmp_path, output / CHECKPOINT_FILE)
+
+
+def score_chunk(chunk: dict, output: str) -> tuple:
+    '''
+    Scores the row groups of `chunk` with the worker's model, and writes them to the chunk's part.
+    Returns the part's name and number of rows
+    '''
+    parquet_file = pq.ParquetFile(chunk['path'])
+    columns = FEATURE_COLS + ([constants.ID_COL] if constants.ID_COL in parquet_file.schema_arrow.names else [])
+    table = parquet_file.read_row_groups(chunk['row_groups'], columns=columns)
+
+    X = np.column_stack([table.column(name).to_numpy().astype(np.float64, copy=False) for name in FEATURE_COLS])
+    if _SCALER is not None:
+        X = _SCALER.transform(X)
+
+    if isinstance(_MODEL, compiled.CompiledSVC):
+        scores = _MODEL.decision_function(X)
+        # the same rule as `CompiledSVC.predict()`
+        result = {'prediction': _MODEL.classes[(scores >= 0).astype(np.intp)], 'decision_function': scores.astype(np.float64)}
+    else:
+        if hasattr(_MODEL, 'feature_names_in_'):
+            # fitted on a DataFrame, give it one so it doesn't warn about every chunk
+            import pandas as pd
+            X = pd.DataFrame(X, columns=FEATURE_COLS)
+        result = {'prediction': _MODEL.predict(X)}
+        if hasattr(_MODEL, 'decision_function'):
+            result['decision_function'] = np.asarray(_MODEL.decision_function(X), dtype=np.float64)
+        else:
+            result['probability'] = np.asarray(_MODEL.predict_proba(X)[:, 1], dtype=np.float64)
+
+    if constants.ID_COL in columns:
+        result = {constants.ID_COL: table.column(constants.ID_COL), **result}
+
+    # written under another name and renamed, so a part that exists is always complete
+    part = Path(output) / chunk['part']
+    tmp_path = part.with_name(f'_{part.name}.tmp')
+    pq.write_table(pa.table(result), tmp_path)
+    os.replace(tmp_path, part)
+    return chunk['part'], table.num_rows
+
+
+def _init_worker(model_path: str, scaler_path: str):
+    '''Loads the compiled model at `model_path`, or the mlflow sklearn model if it's a model folder'''
+    global _MODEL, _SCALER
+    if os.path.isdir(model_path):
+        # only imported (with sklearn) for models that weren't compiled
+        import mlflow.sklearn
+        _MODEL = mlflow.sklearn.load_model(model_path)
+    else:
+        # memory-mapped, so every worker process shares one copy of the model
+        _MODEL = compiled.CompiledSVC.load(model_path, mmap=True)
+    _SCALER = scaling.Standardizer.load(scaler_path) if scaler_path is not None else None
+
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _folder_hash(folder: Path) -> str:
+    '''Hash of every file in a model folder, with their names'''
+    digest = hashlib.sha256()
+    for path in sorted(path for path in folder.rglob('*') if path.is_file()):
+        digest.update(str(path.relative_to(folder)).encode())
+        digest.update(_file_hash(path).encode())
+    return digest.hexdigest()
@@ -0,0 +1 @@
+from .clean import clean
@@ -0,0 +1,91 @@
+'''
+Removes outliers from the training data and standardizes the features
+
+This used to only be done in `develop/preprocess.ipynb`. Here the quartiles of every column are
+computed in one `np.quantile` call and the outliers flagged with a single boolean-matrix reduction,
+instead of a loop over the columns and a `Counter` over the row indices, so it scales to millions of rows.
+
+Outliers are only removed from the train split: the validation and test splits (like the endpoint)
+have to be scored whatever they contain, so they are only scaled.
+'''
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import mlflow
+
+from .. import constants, metrics
+from ..scaling import FILE_NAME, Standardizer
+
+FEATURE_COLS = constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS
+
+
+def clean(
+    train_data, val_data, test_data,
+    clean_train_data, clean_val_data, clean_test_data, scaler_output,
+    method='iqr'
+):
+    '''
+    Drops the outliers (found with `method`, `'iqr'`, `'lof'` or `'none'`) from the train data,
+    fits a `Standardizer` on what's left, and writes the scaled splits and the scaler
+    '''
+    mlflow.start_run()
+
+    train = pd.read_parquet(Path(train_data))
+    X_train = train[FEATURE_COLS].to_numpy(dtype=np.float64)
+
+    if method == 'iqr':
+        outliers = iqr_outliers(X_train)
+    elif method == 'lof':
+        outliers = lof_outliers(X_train)
+    elif method == 'none':
+        outliers = np.zeros(len(X_train), dtype=bool)
+    else:
+        raise ValueError(f'Unknown outlier method {method!r}, expected "iqr", "lof" or "none"')
+
+    print(f'Removing {outliers.sum()} of {len(train)} training rows as outliers ({method})')
+    metrics.log_param('outlier method', method)
+    metrics.log_metric('outliers removed', int(outliers.sum()))
+
+    train = train[~outliers]
+    scaler = Standardizer.fit(X_train[~outliers], FEATURE_COLS)
+    scaler.save(Path(scaler_output) / FILE_NAME)
+
+    _write_scaled(train, scaler, Path(clean_train_data) / 'train.parquet')
+    for name, folder, output in (('val', val_data, clean_val_data), ('test', test_data, clean_test_data)):
+        # the non-streaming prep doesn't write a validation split
+        if not any(Path(folder).glob('*.parquet')):
+            print(f'No {name} data, skipping')
+            continue
+        _write_scaled(pd.read_parquet(Path(folder)), scaler, Path(output) / f'{name}.parquet')
+
+    metrics.end()
+    mlflow.end_run()
+
+
+def iqr_outliers(X: np.ndarray, whis=1.5, max_outlier_columns=9) -> np.ndarray:
+    '''
+    Flags the rows that are more than `whis` IQRs outside the quartiles in more than
+    `max_outlier_columns` columns (like `detect_outliers` in `develop/preprocess.ipynb`)
+    '''
+    q1, q3 = np.quantile(X, [0.25, 0.75], axis=0)
+    step = (q3 - q1) * whis
+    flags = (X < q1 - step) | (X > q3 + step)
+    return np.count_nonzero(flags, axis=1) > max_outlier_columns
+
+
+def lof_outliers(X: np.ndarray, threshold=-2.0) -> np.ndarray:
+    '''
+    Flags the rows with a local outlier factor score below `threshold` (the LOF cleaning in `develop/preprocess.ipynb`)
+    '''
+    # only import sklearn if we need it
+    from sklearn.neighbors import LocalOutlierFactor
+
+    lof = LocalOutlierFactor(n_jobs=-1).fit(X)
+    return lof.negative_outlier_factor_ < threshold
+
+
+def _write_scaled(data: pd.DataFrame, scaler: Standardizer, path: Path):
+    data = data.copy()
+    data[FEATURE_COLS] = scaler.transform(data[FEATURE_COLS].to_numpy(dtype=np.float64))
+    data.to_parquet(path, index=False)
@@ -0,0 +1,164 @@
+'''
+A compiled, NumPy-only version of our trained SVC
+
+`export()` writes the support vectors, dual coefficients, intercept and kernel parameters
+of a fitted sklearn `SVC` into a single `.npz` file, which `CompiledSVC` can load and predict
+with using nothing but NumPy. This lets the endpoint skip importing scikit-learn
+and sklearn's per-call input validation.
+
+`export(..., dtype=np.float32)` writes a reduced-precision copy, with float32 support vectors and
+coefficients that `CompiledSVC` also predicts in float32: half the memory and memory bandwidth per replica.
+The evaluate stage only lets it be registered if its predictions agree with the full-precision model's.
+
+NOTE: `azure/deploy/compiled_model.py` has a copy of `CompiledSVC`, since only the
+`azure/deploy` folder is uploaded with the scoring script. Keep the two in sync, `tests/copies` fails if they aren't!
+'''
+import struct
+import zipfile
+from pathlib import Path
+
+import numpy as np
+
+# saved next to the mlflow model files in the model folder
+FILE_NAME = 'compiled_model.npz'
+FLOAT32_FILE_NAME = 'compiled_model_float32.npz'
+
+SUPPORTED_KERNELS = ('linear', 'poly', 'rbf', 'sigmoid')
+
+
+def supports(model) -> bool:
+    '''Whether `export()` can compile `model`: a fitted sklearn `SVC`, or a model with a `kernel_expansion()`'''
+    return hasattr(model, 'kernel_expansion') or (
+        hasattr(model, 'support_vectors_') and getattr(model, 'kernel', None) in SUPPORTED_KERNELS
+    )
+
+
+def export(model, path, dtype=np.float64) -> Path:
+    '''
+    Writes the parameters of a fitted binary sklearn `SVC` to `path`, its arrays as `dtype`.
+    Only reads attributes off the model, so this doesn't import sklearn either.
+
+    Models that predict with the same kernel expansion as an SVC (e.g. `NystroemSGDClassifier`
+    in `pipeline/train/approximate.py`) can be exported too, by giving them a `kernel_expansion()`
+    method returning the arrays below
+    '''
+    if hasattr(model, 'kernel_expansion'):
+        params = model.kernel_expansion()
+    else:
+        if model.kernel not in SUPPORTED_KERNELS:
+            raise ValueError(f'Cannot compile SVC with kernel {model.kernel!r}')
+        params = {
+            'kernel': model.kernel,
+            'degree': model.degree,
+            # `_gamma` is the actual value used, even if `gamma='scale'` or `gamma='auto'`
+            'gamma': model._gamma,
+            'coef0': model.coef0,
+            'support_vectors': model.support_vectors_,
+            'dual_coef': model.dual_coef_[0],
+            'intercept': model.intercept_[0],
+            'classes': model.classes_,
+        }
+    if len(params['classes']) != 2:
+        raise ValueError(f'Can only compile binary models, got {len(params["classes"])} classes')
+
+    path = Path(path)
+    np.savez(
+        path,
+        kernel=np.array(params['kernel']),
+        degree=np.array(params['degree'], dtype=np.float64),
+        gamma=np.array(params['gamma'], dtype=np.float64),
+        coef0=np.array(params['coef0'], dtype=np.float64),
+        support_vectors=np.ascontiguousarray(params['support_vectors'], dtype=dtype),
+        dual_coef=np.ascontiguousarray(params['dual_coef'], dtype=dtype),
+        intercept=np.array(params['intercept'], dtype=np.float64),
+        classes=np.asarray(params['classes']),
+    )
+    return path
+
+
+class CompiledSVC:
+    '''
+    Predicts like a binary sklearn `SVC`, using only NumPy.
+    Inputs are cast to the dtype of the support vectors, so a float32 model predicts in float32
+    '''
+
+    def __init__(self, kernel, degree, gamma, coef0, support_vectors, dual_coef, intercept, classes):
+        self.kernel = str(kernel)
+        self.degree = float(degree)
+        self.gamma = float(gamma)
+        self.coef0 = float(coef0)
+        self.support_vectors = support_vectors
+        self.dual_coef = dual_coef
+        self.intercept = float(intercept)
+        self.classes = classes
+        self.dtype = support_vectors.dtype
+
+    @classmethod
+    def load(cls, path, mmap=False) -> 'CompiledSVC':
+        '''
+        With `mmap=True`, the support vectors and coefficients are memory-mapped read-only instead of read into memory,
+        so every process serving the same model file shares one physical copy of them (through the page cache)
+        '''
+        if mmap:
+            return cls(**_mmap_npz(path))
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+    def _kernel(self, X: np.ndarray) -> np.ndarray:
+        '''Kernel matrix between the rows of `X` and the support vectors'''
+        if self.kernel == 'rbf':
+            # ||x - sv||^2 = ||x||^2 - 2 x.sv + ||sv||^2
+            sq_dist = (
+                np.einsum('ij,ij->i', X, X)[:, None]
+                - 2 * X @ self.support_vectors.T
+                + np.einsum('ij,ij->i', self.support_vectors, self.support_vectors)[None, :]
+            )
+            return np.exp(-self.gamma * np.maximum(sq_dist, 0))
+
+        dot = X @ self.support_vectors.T
+        if self.kernel == 'linear':
+            return dot
+        if self.kernel == 'poly':
+            return (self.gamma * dot + self.coef0) ** self.degree
+        return np.tanh(self.gamma * dot + self.coef0)
+
+    def decision_function(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=self.dtype)
+        return self._kernel(X) @ self.dual_coef + self.intercept
+
+    def predict(self, X) -> np.ndarray:
+        # libsvm picks the second class when the decision value is exactly 0
+        return self.classes[(self.decision_function(X) >= 0).astype(np.intp)]
+
+
+def _mmap_npz(path) -> dict:
+    '''
+    The arrays of a `.npz` written by `np.savez`, memory-mapped read-only. `np.load` can't map a `.npz`,
+    but `np.savez` stores its `.npy` members uncompressed, so each one can be mapped at its offset in the file
+    '''
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'Cannot memory-map {path}, {info.filename} is compressed')
+
+            # the member's local header: 30 bytes, ending with the lengths of its file name and extra field
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if not shape or dtype.hasobject:
+                # scalars (the kernel parameters) are read as usual, there's nothing to share
+                arrays[name] = np.lib.format.read_array(archive.open(info), allow_pickle=False)
+            else:
+                arrays[name] = np.memmap(
+                    path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C'
+                )
+    return arrays
@@ -4,6 +4,9 @@ constants relating to the Wisconsin BCa dataset
 
 TARGET_COL = "diagnosis_01"
 
+# unique id of each case, if the raw data has one. Used to split the data reproducibly
+ID_COL = "id"
+
 NUMERIC_COLS = [
     'texture_mean',
     'smoothness_mean',
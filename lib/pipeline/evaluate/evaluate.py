@@ -2,23 +2,36 @@
 Read trained model and test dataset, evaluate model and save result
 '''
 
+import hashlib
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-
 import mlflow
 import mlflow.sklearn
-import mlflow.pyfunc
 from mlflow.tracking import MlflowClient
 
-from .. import constants
+from .. import compiled, constants, metrics, scaling
+
 
+def evaluate(
+    model_name, model_input, test_data, evaluation_output, runner="CloudRunner", max_versions=10,
+    max_float32_mismatch_rate=0.0, raw_test_data=None
+):
+    '''
+    Read trained model and test dataset, evaluate model and save result
 
-def evaluate(model_name, model_input, test_data, evaluation_output, runner="CloudRunner"):
-    '''Read trained model and test dataset, evaluate model and save result'''
+    The model is compared against (at most) the `max_versions` latest registered versions, on `raw_test_data`
+    (the test split before the clean stage scaled it), which each version scales with its own scaler.
+    Its float32 copy is only registered if it disagrees with the model on at most
+    `max_float32_mismatch_rate` of the test rows
+    '''
     mlflow.start_run()
 
     mlflow.sklearn.autolog()
@@ -36,11 +49,19 @@ def evaluate(model_name, model_input, test_data, evaluation_output, runner="Clou
     # ---------------- Model Evaluation ---------------- #
     yhat_test, score = model_evaluation(X_test, y_test, model, evaluation_output)
 
+    # ----------- Compiled Model Parity ------------ #
+    compiled_parity(model_input, X_test, yhat_test)
+    float32_parity(model_input, X_test, yhat_test, evaluation_output, max_float32_mismatch_rate)
+
     # ----------------- Model Promotion ---------------- #
     # Local or Cloud Runner
     if runner == "CloudRunner":
-        predictions, deploy_flag = model_promotion(model_name, evaluation_output, X_test, y_test, yhat_test, score)
+        X_raw, y_raw = raw_test_set(model_input, raw_test_data, X_test, y_test)
+        predictions, deploy_flag = model_promotion(
+            model_name, evaluation_output, X_raw, y_raw, yhat_test, score, max_versions
+        )
     
+    metrics.end()
     mlflow.end_run()
 
 
@@ -72,36 +93,167 @@ def model_evaluation(X_test, y_test, model, evaluation_output):
         outfile.write("Mean absolute error: {mae.2f} \n")
         outfile.write("Coefficient of determination: {r2.2f} \n")
 
-    mlflow.log_metric("test r2", r2)
-    mlflow.log_metric("test mse", mse)
-    mlflow.log_metric("test rmse", rmse)
-    mlflow.log_metric("test mae", mae)
+    metrics.log_metric("test r2", r2)
+    metrics.log_metric("test mse", mse)
+    metrics.log_metric("test rmse", rmse)
+    metrics.log_metric("test mae", mae)
 
     # Visualize results
+    # matplotlib is slow to import, so only import it once we actually plot
+    from matplotlib import pyplot as plt
     plt.scatter(y_test, yhat_test,  color='black')
     plt.plot(y_test, y_test, color='blue', linewidth=3)
     plt.xlabel("Real value")
     plt.ylabel("Predicted value")
     plt.title("Comparing Model Predictions to Real values - Test Data")
-    plt.savefig("predictions.png")
-    mlflow.log_artifact("predictions.png")
+    # logged straight from memory, so nothing is left behind in the working directory
+    mlflow.log_figure(plt.gcf(), "predictions.png")
+    plt.close()
 
     return yhat_test, r2
 
-def model_promotion(model_name, evaluation_output, X_test, y_test, yhat_test, score):
-    
+def compiled_parity(model_input, X_test, yhat_test):
+    '''
+    The endpoint serves the NumPy-only compiled model (see `pipeline/compiled.py`) instead of the sklearn one,
+    so its predictions on the test set have to be identical to the sklearn model's
+    '''
+    compiled_path = Path(model_input) / compiled.FILE_NAME
+    if not compiled_path.exists():
+        print(f'No compiled model found at {compiled_path}, skipping parity check')
+        return
+
+    compiled_model = compiled.CompiledSVC.load(compiled_path)
+    mismatches = int(np.sum(compiled_model.predict(X_test.to_numpy()) != np.asarray(yhat_test)))
+    metrics.log_metric("compiled mismatches", mismatches)
+
+    if mismatches:
+        raise ValueError(
+            f'Compiled model disagrees with the sklearn model on {mismatches}/{len(X_test)} test rows'
+        )
+    print('Compiled model predictions match the sklearn model')
+
+def float32_parity(model_input, X_test, yhat_test, evaluation_output, max_mismatch_rate=0.0):
+    '''
+    The endpoint can serve the float32 copy of the compiled model (`SCORE_PRECISION=float32`), which
+    may round a few borderline rows the other way. Writes `float32_flag`, 1 if it disagrees with the
+    sklearn model on at most `max_mismatch_rate` of the test rows, for register to only ship it then
+    '''
+    float32_path = Path(model_input) / compiled.FLOAT32_FILE_NAME
+    if not float32_path.exists():
+        print(f'No float32 model found at {float32_path}, skipping parity check')
+        return
+
+    float32_model = compiled.CompiledSVC.load(float32_path)
+    X = X_test.to_numpy()
+    mismatches = int(np.sum(float32_model.predict(X) != np.asarray(yhat_test)))
+    mismatch_rate = mismatches / len(X_test)
+    metrics.log_metric("float32 mismatches", mismatches)
+    metrics.log_metric("float32 mismatch rate", mismatch_rate)
+
+    full_path = Path(model_input) / compiled.FILE_NAME
+    if full_path.exists():
+        decision_error = np.abs(
+            float32_model.decision_function(X).astype(np.float64) - compiled.CompiledSVC.load(full_path).decision_function(X)
+        )
+        metrics.log_metric("float32 max decision error", float(decision_error.max()))
+
+    float32_flag = int(mismatch_rate <= max_mismatch_rate)
+    if float32_flag:
+        print(f'float32 model disagrees on {mismatches}/{len(X_test)} test rows, within {max_mismatch_rate:.2%}')
+    else:
+        print(f'float32 model disagrees on {mismatches}/{len(X_test)} test rows, more than {max_mismatch_rate:.2%}: rejected')
+    metrics.log_metric("float32 flag", float32_flag)
+
+    with open((Path(evaluation_output) / "float32_flag"), 'w') as outfile:
+        outfile.write(f"{float32_flag}")
+
+def test_set_hash(X_test, y_test):
+    '''Hash of the test set's column names and contents, so cached scores are only reused on the same data'''
+    digest = hashlib.sha256()
+    digest.update(",".join(X_test.columns).encode())
+    digest.update(pd.util.hash_pandas_object(X_test, index=False).to_numpy().tobytes())
+    digest.update(pd.util.hash_pandas_object(y_test, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def raw_test_set(model_input, raw_test_data, X_test, y_test):
+    '''
+    The test set before scaling, to score the registered versions on: `raw_test_data` if given,
+    otherwise `X_test` unscaled with the model's scaler (or `X_test` itself if the model has none)
+    '''
+    if raw_test_data is not None:
+        raw = pd.read_parquet(Path(raw_test_data))
+        return raw[list(X_test.columns)], raw[constants.TARGET_COL]
+
+    scaler_path = Path(model_input) / scaling.FILE_NAME
+    if not scaler_path.exists():
+        return X_test, y_test
+    scaler = scaling.Standardizer.load(scaler_path)
+    X_raw = scaler.inverse_transform(X_test.to_numpy(dtype=np.float64))
+    return pd.DataFrame(X_raw, columns=X_test.columns, index=X_test.index), y_test
+
+def score_model_version(model_uri, X_test, y_test):
+    '''
+    Loads a registered model and scores it on the raw test set, scaled with the scaler registered
+    with it (like `azure/deploy/score.py` does), if it has one. Runs in a worker process
+    '''
+    import mlflow.pyfunc
+    with tempfile.TemporaryDirectory() as tmp:
+        model_folder = Path(mlflow.artifacts.download_artifacts(artifact_uri=model_uri, dst_path=tmp))
+        mdl = mlflow.pyfunc.load_model(str(model_folder))
+        scaler_path = model_folder / scaling.FILE_NAME
+        if scaler_path.exists():
+            X_scaled = scaling.Standardizer.load(scaler_path).transform(X_test.to_numpy(dtype=np.float64))
+            X_test = pd.DataFrame(X_scaled, columns=X_test.columns, index=X_test.index)
+        version_predictions = mdl.predict(X_test)
+    return version_predictions, r2_score(y_test, version_predictions)
+
+def model_promotion(model_name, evaluation_output, X_test, y_test, yhat_test, score, max_versions=10):
+    '''
+    Compares the current model against the `max_versions` latest registered versions,
+    on the raw (unscaled) test set `X_test`, `y_test`.
+
+    The score of a registered version on a test set never changes, so it's saved as a tag on the
+    model version (keyed by a hash of the test set), and only versions without one are scored,
+    in parallel processes. `predictions` only holds the versions that were scored in this run
+    '''
     scores = {}
     predictions = {}
 
     client = MlflowClient()
-
-    for model_run in client.search_model_versions(f"name='{model_name}'"):
-        model_version = model_run.version
-        mdl = mlflow.pyfunc.load_model(
-            model_uri=f"models:/{model_name}/{model_version}")
-        predictions[f"{model_name}:{model_version}"] = mdl.predict(X_test)
-        scores[f"{model_name}:{model_version}"] = r2_score(
-            y_test, predictions[f"{model_name}:{model_version}"])
+    # the older "r2 score" tags were scored before each version's own scaler was applied, and may be wrong
+    score_tag = f"raw r2 score {test_set_hash(X_test, y_test)}"
+
+    model_versions = sorted(
+        client.search_model_versions(f"name='{model_name}'"),
+        key=lambda model_run: int(model_run.version),
+        reverse=True
+    )[:max_versions]
+
+    uncached = []
+    for model_run in model_versions:
+        if score_tag in model_run.tags:
+            scores[f"{model_name}:{model_run.version}"] = float(model_run.tags[score_tag])
+        else:
+            uncached.append(model_run)
+    print(f"{len(scores)} cached scores, scoring {len(uncached)} model versions")
+
+    if uncached:
+        # the artifacts each version was registered from, which (unlike `models:/` URIs) hold its scaler, see `register.py`
+        model_uris = [f"runs:/{model_run.run_id}/{model_name}" for model_run in uncached]
+        uncached = [model_run.version for model_run in uncached]
+        # spawned rather than forked, the batch logger's thread is already running (see `metrics.py`).
+        # Spawned workers don't inherit a tracking URI that was set with `mlflow.set_tracking_uri()` (like `local.py` does)
+        with ProcessPoolExecutor(
+            max_workers=min(len(uncached), os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=mlflow.set_tracking_uri,
+            initargs=(mlflow.get_tracking_uri(),)
+        ) as pool:
+            results = pool.map(score_model_version, model_uris, repeat(X_test), repeat(y_test))
+            for model_version, (version_predictions, version_score) in zip(uncached, results):
+                predictions[f"{model_name}:{model_version}"] = version_predictions
+                scores[f"{model_name}:{model_version}"] = version_score
+                client.set_model_version_tag(model_name, model_version, score_tag, str(version_score))
 
     if scores:
         if score >= max(list(scores.values())):
@@ -121,11 +273,12 @@ def model_promotion(model_name, evaluation_output, X_test, y_test, yhat_test, sc
 
     perf_comparison_plot = pd.DataFrame(
         scores, index=["r2 score"]).plot(kind='bar', figsize=(15, 10))
-    perf_comparison_plot.figure.savefig("perf_comparison.png")
     perf_comparison_plot.figure.savefig(Path(evaluation_output) / "perf_comparison.png")
+    mlflow.log_figure(perf_comparison_plot.figure, "perf_comparison.png")
+    from matplotlib import pyplot as plt
+    plt.close(perf_comparison_plot.figure)
 
-    mlflow.log_metric("deploy flag", bool(deploy_flag))
-    mlflow.log_artifact("perf_comparison.png")
+    metrics.log_metric("deploy flag", bool(deploy_flag))
 
     return predictions, deploy_flag
 
@@ -0,0 +1,173 @@
+'''
+Buffered, asynchronous mlflow logging for the pipeline stages
+
+In Azure every `mlflow.log_metric()` / `log_param()` call is a round trip to the tracking server,
+made on the stage's critical path. `BatchLogger` buffers metrics, params and tags instead, and a
+background thread sends them with `MlflowClient.log_batch()` every `flush_interval` seconds.
+Whatever is left is sent when the stage calls `end()` (or when the process exits).
+
+The module-level functions mirror mlflow's fluent API, and log to the active run:
+
+    mlflow.start_run()
+    metrics.log_metric("test r2", r2)
+    metrics.end()
+    mlflow.end_run()
+
+See `tests/metrics` to try it against a local file store.
+'''
+import atexit
+import threading
+import time
+
+import mlflow
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.tracking import MlflowClient
+
+FLUSH_INTERVAL = 1.0
+
+# limits of a single `log_batch` request, see https://mlflow.org/docs/latest/rest-api.html#log-batch
+MAX_ENTITIES = 1000
+MAX_PARAMS = 100
+MAX_TAGS = 100
+
+
+class BatchLogger:
+    '''
+    Buffers metrics, params and tags for one run, and sends them in batches from a background thread
+    '''
+
+    def __init__(self, run_id: str, client: MlflowClient = None, flush_interval=FLUSH_INTERVAL):
+        self.run_id = run_id
+        self.client = client or MlflowClient()
+        self.flush_interval = flush_interval
+
+        self._metrics = []
+        # params can't change once logged, so there's no point sending the same one twice
+        self._params = {}
+        self._tags = {}
+        self._lock = threading.Lock()
+        # only one batch is sent at a time, so metrics arrive in the order they were logged
+        self._send_lock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._wake = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._loop, name='mlflow-batch-logger', daemon=True)
+        self._thread.start()
+
+    def log_metric(self, key: str, value, step=0):
+        self.log_metrics({key: value}, step)
+
+    def log_metrics(self, metrics: dict, step=0):
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            self._metrics.extend(Metric(key, float(value), timestamp, step) for key, value in metrics.items())
+            if len(self._metrics) >= MAX_ENTITIES:
+                self._wake.set()
+
+    def log_param(self, key: str, value):
+        self.log_params({key: value})
+
+    def log_params(self, params: dict):
+        with self._lock:
+            self._params.update((key, str(value)) for key, value in params.items())
+
+    def set_tag(self, key: str, value):
+        with self._lock:
+            self._tags[key] = str(value)
+
+    def flush(self):
+        '''Sends everything logged so far, in the calling thread'''
+        with self._send_lock:
+            with self._lock:
+                metrics, params, tags = self._metrics, self._params, self._tags
+                self._metrics, self._params, self._tags = [], {}, {}
+
+            params = [Param(key, value) for key, value in params.items()]
+            tags = [RunTag(key, value) for key, value in tags.items()]
+            try:
+                while metrics or params or tags:
+                    batch_params, params = params[:MAX_PARAMS], params[MAX_PARAMS:]
+                    batch_tags, tags = tags[:MAX_TAGS], tags[MAX_TAGS:]
+                    n_metrics = MAX_ENTITIES - len(batch_params) - len(batch_tags)
+                    batch_metrics, metrics = metrics[:n_metrics], metrics[n_metrics:]
+                    self.client.log_batch(self.run_id, metrics=batch_metrics, params=batch_params, tags=batch_tags)
+            except Exception:
+                # put back what wasn't sent (the failed batch included), so the next flush retries it
+                with self._lock:
+                    self._metrics = batch_metrics + metrics + self._metrics
+                    self._params = {**{p.key: p.value for p in batch_params + params}, **self._params}
+                    self._tags = {**{t.key: t.value for t in batch_tags + tags}, **self._tags}
+                raise
+
+    def close(self):
+        '''Stops the background thread and sends whatever is left. Raises if that fails'''
+        self._closed.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+    def _loop(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # not fatal yet, `close()` tries again and raises if it still fails
+                if repr(e) != repr(self._error):
+                    print(f'Failed to log a batch to mlflow, will retry: {e}')
+                self._error = e
+
+
+# ---- Fluent API, logs to the active run ---- #
+
+_logger: BatchLogger = None
+
+
+def start(flush_interval=FLUSH_INTERVAL) -> BatchLogger:
+    '''Starts buffering for the active mlflow run (starting one if needed, like `mlflow.log_metric` does)'''
+    global _logger
+    end()
+    run = mlflow.active_run() or mlflow.start_run()
+    _logger = BatchLogger(run.info.run_id, flush_interval=flush_interval)
+    return _logger
+
+
+def _get() -> BatchLogger:
+    active_run = mlflow.active_run()
+    if _logger is None or (active_run is not None and active_run.info.run_id != _logger.run_id):
+        return start()
+    return _logger
+
+
+def log_metric(key: str, value, step=0):
+    _get().log_metric(key, value, step)
+
+
+def log_metrics(metrics: dict, step=0):
+    _get().log_metrics(metrics, step)
+
+
+def log_param(key: str, value):
+    _get().log_param(key, value)
+
+
+def log_params(params: dict):
+    _get().log_params(params)
+
+
+def set_tag(key: str, value):
+    _get().set_tag(key, value)
+
+
+def end():
+    '''Sends everything that's still buffered. Call this before `mlflow.end_run()`'''
+    global _logger
+    if _logger is not None:
+        logger, _logger = _logger, None
+        logger.close()
+
+
+# if a stage fails halfway through, still send what it logged (this runs before mlflow ends the run)
+atexit.register(end)
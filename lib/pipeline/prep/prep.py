@@ -7,15 +7,29 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import mlflow
 
-from .. import constants
+from .. import constants, metrics, watermark
 
+# fraction of rows in each split when streaming. Each row goes to the first split whose
+# cumulative fraction is above the row's hash, see `split_buckets()`
+SPLITS = [('train', 0.7), ('val', 0.15), ('test', 0.15)]
 
-def prep(raw_data, train_data, val_data, test_data):
+
+def prep(raw_data, train_data, val_data, test_data, streaming=False, incremental=False, batch_size=65536):
     '''
     A code-version of what was in `pipeline.yml`
+
+    With `streaming=True`, the raw data is read and split one record batch at a time (see `prep_streaming()`)
+    With `incremental=True`, only raw files that haven't been split before are streamed,
+    and appended to the existing splits (see `pipeline/watermark.py`)
     '''
+    if streaming or incremental:
+        prep_streaming(raw_data, train_data, val_data, test_data, batch_size, incremental)
+        return
+
     mlflow.start_run()
 
     # ----------  Arguments ----------- #
@@ -52,10 +66,115 @@ def prep(raw_data, train_data, val_data, test_data):
     train = data[msk_train]
     test = data[msk_test]
 
-    mlflow.log_metric('train size', train.shape[0])
-    mlflow.log_metric('test size', test.shape[0])
+    metrics.log_metric('train size', train.shape[0])
+    metrics.log_metric('test size', test.shape[0])
 
     train.to_parquet((Path(train_data) / "train.parquet"))
     test.to_parquet((Path(test_data) / "test.parquet"))
 
+    metrics.end()
+    mlflow.end_run()
+
+
+def prep_streaming(raw_data, train_data, val_data, test_data, batch_size=65536, incremental=False):
+    '''
+    Splits the raw data into train, validation and test datasets without loading it all into memory.
+
+    The raw parquet is read `batch_size` rows at a time, and every batch is appended to the split files
+    as it's processed, so memory use stays flat however big the data is.
+    Rows are assigned to a split by a hash of their id (or their contents, if there's no id column),
+    so the same row always ends up in the same split, across runs and as the data grows
+
+    `raw_data` can be a parquet file or a folder of them. With `incremental=True`, the splits are kept
+    as partitions (`train-00000.parquet`, ...), and each run only splits the raw files that are new since
+    the last run, into a new partition. If a raw file was modified or removed, or the schema changed,
+    everything is rebuilt from scratch
+    '''
+    mlflow.start_run()
+
+    outputs = {'train': Path(train_data), 'val': Path(val_data), 'test': Path(test_data)}
+    raw_files = watermark.raw_files(raw_data)
+
+    if incremental:
+        schema = watermark.schema_hash(SPLITS)
+        checksums = {name: watermark.checksum(path) for name, path in raw_files.items()}
+        state = watermark.load(outputs['train'])
+
+        reason = watermark.rebuild_reason(state, schema, checksums)
+        if reason is None:
+            new_files = [name for name in raw_files if name not in state['files']]
+            part = state['parts']
+        else:
+            print(f"Rebuilding all splits: {reason}")
+            watermark.clear(outputs.values())
+            new_files = list(raw_files)
+            part = 0
+        print(f"{len(new_files)} new raw files out of {len(raw_files)}")
+        file_name = f"{{split}}-{part:05d}.parquet"
+    else:
+        new_files = list(raw_files)
+        file_name = "{split}.parquet"
+
+    sizes = {name: 0 for name in outputs}
+    if new_files:
+        sizes = write_splits(
+            [raw_files[name] for name in new_files],
+            {name: folder / file_name.format(split=name) for name, folder in outputs.items()},
+            batch_size
+        )
+
+    if incremental:
+        watermark.save(outputs['train'], schema, checksums, part + 1 if new_files else part)
+
+    for name, size in sizes.items():
+        metrics.log_metric(f'{name} size', size)
+
+    metrics.end()
     mlflow.end_run()
+
+
+def write_splits(raw_paths, outputs, batch_size):
+    '''
+    Streams the rows of every file in `raw_paths` into the `outputs` parquet files (one per split).
+    Returns the number of rows written to each split
+    '''
+    columns = constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS + [constants.TARGET_COL]
+
+    # every split gets a file, even if no rows end up in it
+    first_file = pq.ParquetFile(raw_paths[0])
+    schema = pa.schema([first_file.schema_arrow.field(column) for column in columns])
+    writers = {name: pq.ParquetWriter(path, schema) for name, path in outputs.items()}
+    sizes = {name: 0 for name in outputs}
+
+    try:
+        for raw_path in raw_paths:
+            raw_file = pq.ParquetFile(raw_path)
+            has_id = constants.ID_COL in raw_file.schema_arrow.names
+            print(f"Streaming {raw_file.metadata.num_rows} rows from {raw_path} in batches of {batch_size}, "
+                  f"splitting by {'id' if has_id else 'row contents'}")
+
+            read_columns = columns + [constants.ID_COL] if has_id else columns
+            for batch in raw_file.iter_batches(batch_size=batch_size, columns=read_columns):
+                batch_data = batch.to_pandas()
+                buckets = split_buckets(batch_data[[constants.ID_COL]] if has_id else batch_data[columns])
+
+                for bucket, name in enumerate(outputs):
+                    split = batch_data.loc[buckets == bucket, columns]
+                    writers[name].write_table(pa.Table.from_pandas(split, schema=schema, preserve_index=False))
+                    sizes[name] += len(split)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return sizes
+
+
+def split_buckets(keys: pd.DataFrame) -> np.ndarray:
+    '''
+    Index of the split (in `SPLITS`) each row belongs to, from a stable 64 bit hash of `keys`
+    '''
+    # `hash_pandas_object` uses a fixed hash key, so the hashes are the same on every run and machine
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    position = hashes / np.float64(2 ** 64)
+    boundaries = np.cumsum([fraction for _, fraction in SPLITS])[:-1]
+    return np.searchsorted(boundaries, position, side='right')
@@ -5,6 +5,9 @@ import json
 
 from pathlib import Path
 import mlflow
+from mlflow.models import Model
+
+from .. import compiled, metrics, scaling
 
 def register(model_name, model_path, evaluation_output, model_info_output_path):
     '''Loads model, registers it if deply flag is True'''
@@ -12,7 +15,7 @@ def register(model_name, model_path, evaluation_output, model_info_output_path):
     with open((Path(evaluation_output) / "deploy_flag"), 'rb') as infile:
         deploy_flag = int(infile.read())
         
-    mlflow.log_metric("deploy flag", int(deploy_flag))
+    metrics.log_metric("deploy flag", int(deploy_flag))
     deploy_flag=1
     if deploy_flag==1:
 
@@ -21,8 +24,26 @@ def register(model_name, model_path, evaluation_output, model_info_output_path):
         # load model
         model =  mlflow.sklearn.load_model(model_path) 
 
-        # log model using mlflow
-        mlflow.sklearn.log_model(model, model_name)
+        # log model using mlflow, keeping its metadata (the update counter of `update/update.py`)
+        # and the types skops was told to trust when it was saved, if any (see `train/approximate.py`)
+        saved = Model.load(model_path)
+        trusted_types = saved.flavors['sklearn'].get('skops_trusted_types')
+        mlflow.sklearn.log_model(
+            model, model_name, metadata=saved.metadata,
+            **({'skops_trusted_types': trusted_types} if trusted_types else {})
+        )
+
+        # keep the compiled model with the registered one, the endpoint loads it instead of `model.pkl`
+        # and the scaler, which it applies to raw inputs
+        file_names = [compiled.FILE_NAME, scaling.FILE_NAME]
+        # the float32 copy of the compiled model only if evaluate found it predicts like the model
+        float32_flag = Path(evaluation_output) / "float32_flag"
+        if float32_flag.exists() and int(float32_flag.read_text()) == 1:
+            file_names.append(compiled.FLOAT32_FILE_NAME)
+        for file_name in file_names:
+            path = Path(model_path) / file_name
+            if path.exists():
+                mlflow.log_artifact(str(path), artifact_path=model_name)
 
         # register logged model using mlflow
         run_id = mlflow.active_run().info.run_id
@@ -39,3 +60,5 @@ def register(model_name, model_path, evaluation_output, model_info_output_path):
 
     else:
         print("Model will not be registered!")
+
+    metrics.end()
@@ -0,0 +1,55 @@
+'''
+Standardization of the features, fitted in the clean stage and applied again by the endpoint
+
+`Standardizer` does what `StandardScaler` did in `develop/preprocess.ipynb`, with the mean and
+standard deviation of every column computed in one vectorized pass. It is saved as a small `.npz`
+next to the model, so the endpoint can take raw measurements instead of callers having to scale them.
+
+NOTE: `azure/deploy/scaling.py` has a copy of `Standardizer.load()` and `transform()`, since only the
+`azure/deploy` folder is uploaded with the scoring script. Keep the two in sync, `tests/copies` fails if they aren't!
+'''
+from pathlib import Path
+
+import numpy as np
+
+# saved next to the mlflow model files in the model folder
+FILE_NAME = 'scaler.npz'
+
+
+class Standardizer:
+    '''
+    Scales every column to zero mean and unit variance, like sklearn's `StandardScaler`
+    '''
+
+    def __init__(self, columns, mean, scale):
+        self.columns = [str(column) for column in columns]
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def fit(cls, X: np.ndarray, columns) -> 'Standardizer':
+        X = np.asarray(X, dtype=np.float64)
+        std = X.std(axis=0)
+        # constant columns are left as they are (after centering), like `StandardScaler` does
+        std[std == 0] = 1.0
+        return cls(columns, X.mean(axis=0), std)
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        if X.shape[-1] != len(self.columns):
+            raise ValueError(f'Expected {len(self.columns)} features, got {X.shape[-1]}')
+        return (X - self.mean) / self.scale
+
+    def inverse_transform(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        return X * self.scale + self.mean
+
+    def save(self, path) -> Path:
+        path = Path(path)
+        np.savez(path, columns=np.array(self.columns), mean=self.mean, scale=self.scale)
+        return path
+
+    @classmethod
+    def load(cls, path) -> 'Standardizer':
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(arrays['columns'].tolist(), arrays['mean'], arrays['scale'])
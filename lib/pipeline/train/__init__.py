@@ -1 +1 @@
-from .train import train
\ No newline at end of file
+from .train import train
@@ -0,0 +1,111 @@
+'''
+Approximate-kernel training engine, for training sets too large for an exact `SVC`
+
+Training an exact SVC is quadratic to cubic in the number of rows, and predicting is linear in the
+number of support vectors, which grows with the training set. `NystroemSGDClassifier` instead maps the
+rows onto `n_components` landmark rows with a Nystroem approximation of our polynomial kernel, and trains
+a linear SVM (hinge loss) on that feature map with mini-batch SGD:
+- fitting is linear in the number of rows, and only ever holds one mini-batch of features in memory
+- predicting is a kernel against the `n_components` landmarks and a dot product, whatever the training set size
+
+Once fitted, `partial_fit()` updates the model with new rows only (see `pipeline/update/update.py`).
+
+The decision function is `kernel(X, landmarks) @ weights + intercept`, the same form as an SVC's,
+so it's exported to the same compiled model format (see `pipeline/compiled.py`) and served the same way.
+'''
+import inspect
+
+import numpy as np
+import mlflow.sklearn
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDClassifier
+
+
+class NystroemSGDClassifier(ClassifierMixin, BaseEstimator):
+    '''
+    Linear SVM trained with mini-batch SGD on a Nystroem approximation of a polynomial kernel.
+    `gamma=None` uses SVC's `gamma='scale'`
+    '''
+
+    def __init__(self, n_components=300, degree=3, gamma=None, coef0=1.0, alpha=1e-4,
+                 batch_size=256, epochs=10, random_state=0):
+        self.n_components = n_components
+        self.degree = degree
+        self.gamma = gamma
+        self.coef0 = coef0
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        self.classes_ = np.unique(y)
+        self.n_features_in_ = X.shape[1]
+
+        variance = X.var()
+        self.gamma_ = self.gamma if self.gamma is not None else (1.0 / (X.shape[1] * variance) if variance > 0 else 1.0)
+        self.nystroem_ = Nystroem(
+            kernel='poly', degree=self.degree, gamma=self.gamma_, coef0=self.coef0,
+            n_components=min(self.n_components, len(X)), random_state=self.random_state
+        ).fit(X)
+
+        self.sgd_ = SGDClassifier(loss='hinge', alpha=self.alpha, random_state=self.random_state)
+        self._sgd_epochs(X, y, self.epochs, np.random.default_rng(self.random_state))
+        return self
+
+    def partial_fit(self, X, y, epochs=None):
+        '''
+        Updates a fitted model with new rows only, keeping its landmarks and continuing SGD from its current
+        weights, so it costs as much as the new rows, not all the rows the model has seen
+        '''
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        if not set(np.unique(y)) <= set(self.classes_):
+            raise ValueError(f'New rows have classes {np.unique(y)}, the model only knows {self.classes_}')
+        # a different shuffle than the previous updates
+        rng = np.random.default_rng([self.random_state, int(self.sgd_.t_)])
+        self._sgd_epochs(X, y, epochs or self.epochs, rng)
+        return self
+
+    def _sgd_epochs(self, X, y, epochs, rng):
+        for _ in range(epochs):
+            order = rng.permutation(len(X))
+            for start in range(0, len(X), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                self.sgd_.partial_fit(self.nystroem_.transform(X[batch]), y[batch], classes=self.classes_)
+
+    def decision_function(self, X) -> np.ndarray:
+        return self.sgd_.decision_function(self.nystroem_.transform(np.asarray(X, dtype=np.float64)))
+
+    def predict(self, X) -> np.ndarray:
+        # the second class at exactly 0, like `CompiledSVC.predict()` (and libsvm), so both engines agree on ties
+        return self.classes_[(self.decision_function(X) >= 0).astype(np.intp)]
+
+    def kernel_expansion(self) -> dict:
+        '''
+        The model as `kernel(X, landmarks) @ weights + intercept`:
+        Nystroem's features are `kernel(X, landmarks) @ normalization.T`, so the SGD weights fold into one vector
+        '''
+        return {
+            'kernel': 'poly',
+            'degree': self.degree,
+            'gamma': self.gamma_,
+            'coef0': self.coef0,
+            'support_vectors': self.nystroem_.components_,
+            'dual_coef': self.nystroem_.normalization_.T @ self.sgd_.coef_[0],
+            'intercept': self.sgd_.intercept_[0],
+            'classes': self.classes_,
+        }
+
+
+def save_kwargs(model) -> dict:
+    '''
+    Extra `mlflow.sklearn.save_model()` arguments for `model`: newer mlflow versions save models with skops,
+    which only loads the types it's told to trust, and it doesn't know about ours (mlflow then keeps the list in `MLmodel`)
+    '''
+    if not isinstance(model, NystroemSGDClassifier) or 'skops_trusted_types' not in inspect.signature(mlflow.sklearn.save_model).parameters:
+        return {}
+    return {'skops_trusted_types': [f'{__name__}.{NystroemSGDClassifier.__name__}']}
@@ -0,0 +1,125 @@
+'''
+Trains several candidate model families in parallel, and picks the one to deploy
+
+The training matrix is written once to a `.npy` file, and every worker process memory-maps it
+instead of getting its own pickled copy. Each worker fits one candidate on part of the training
+set, and measures on the rest of it:
+- its accuracy
+- its fit time
+- its single-row predict latency, as the endpoint would serve it (the compiled model for SVCs)
+
+`select()` then picks the most accurate candidate, optionally within a latency budget
+and/or with a penalty per millisecond of latency.
+'''
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.svm import SVC
+
+from pipeline import compiled
+
+CANDIDATES = {
+    'poly_svc': lambda: SVC(kernel='poly', C=2),
+    'rbf_svc': lambda: SVC(kernel='rbf', C=2),
+    'logistic_regression': lambda: LogisticRegression(max_iter=1000),
+    'gradient_boosting': lambda: GradientBoostingClassifier(random_state=0),
+}
+
+# single-row predictions timed per candidate, the latency is their median
+LATENCY_SAMPLES = 200
+
+
+def parse_candidates(candidates: str) -> list:
+    '''`'all'` or a comma-separated list of `CANDIDATES` names'''
+    names = list(CANDIDATES) if candidates == 'all' else [name.strip() for name in candidates.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CANDIDATES]
+    if unknown or not names:
+        raise ValueError(f'Unknown candidates {unknown}, expected "all" or some of {list(CANDIDATES)}')
+    return names
+
+
+def served_model(model):
+    '''The model the endpoint would serve: the compiled NumPy model for SVCs, the sklearn model otherwise'''
+    if not compiled.supports(model):
+        return model
+    with tempfile.TemporaryDirectory() as tmp:
+        return compiled.CompiledSVC.load(compiled.export(model, Path(tmp) / compiled.FILE_NAME))
+
+
+def evaluate_candidate(name: str, X_path: str, y_path: str, n_fit: int) -> dict:
+    '''
+    Fits one candidate on the first `n_fit` rows of the memory-mapped matrix, and measures it on the rest.
+    Runs in a worker process
+    '''
+    X = np.load(X_path, mmap_mode='r')
+    y = np.load(y_path, mmap_mode='r')
+
+    model = CANDIDATES[name]()
+    start = time.perf_counter()
+    # slices of the memory map are views, so the rows aren't copied into every worker
+    model.fit(X[:n_fit], y[:n_fit])
+    fit_time = time.perf_counter() - start
+
+    X_holdout = np.ascontiguousarray(X[n_fit:])
+    served = served_model(model)
+    accuracy = float(np.mean(served.predict(X_holdout) == y[n_fit:]))
+
+    rows = X_holdout[np.arange(LATENCY_SAMPLES) % len(X_holdout)]
+    latencies = []
+    for row in rows:
+        start = time.perf_counter()
+        served.predict(row[None, :])
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'candidate': name,
+        'accuracy': accuracy,
+        'fit_time_s': fit_time,
+        'predict_latency_ms': float(np.median(latencies) * 1000),
+    }
+
+
+def train_candidates(X, y, names: list, holdout=0.2, n_jobs=None, seed=0) -> list:
+    '''
+    Fits every candidate in `names` in its own worker process (at most `n_jobs` at once, all cores by default),
+    returning their measurements
+    '''
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    fit_idx, holdout_idx = train_test_split(np.arange(len(y)), test_size=holdout, stratify=y, random_state=seed)
+
+    # the rows to fit on go first, so the workers can slice them off the memory map
+    order = np.concatenate([fit_idx, holdout_idx])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        X_path, y_path = os.path.join(tmp, 'X.npy'), os.path.join(tmp, 'y.npy')
+        np.save(X_path, X[order])
+        np.save(y_path, y[order])
+
+        workers = min(len(names), n_jobs or os.cpu_count() or 1)
+        print(f'Training {len(names)} candidates in {workers} worker processes')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(evaluate_candidate, name, X_path, y_path, len(fit_idx)) for name in names]
+            return [future.result() for future in futures]
+
+
+def select(results: list, max_latency_ms=0.0, latency_weight=0.0) -> dict:
+    '''
+    The candidate with the best `accuracy - latency_weight * predict_latency_ms`, among those within
+    `max_latency_ms` (`0` for no budget), the fastest one breaking ties. If none are within the budget, the fastest one
+    '''
+    within_budget = [r for r in results if not max_latency_ms or r['predict_latency_ms'] <= max_latency_ms]
+    if not within_budget:
+        print(f'No candidate predicts within {max_latency_ms}ms, picking the fastest one')
+        return min(results, key=lambda r: r['predict_latency_ms'])
+    return max(
+        within_budget,
+        key=lambda r: (r['accuracy'] - latency_weight * r['predict_latency_ms'], -r['predict_latency_ms'])
+    )
@@ -0,0 +1,110 @@
+'''
+Hyperparameter search for the SVC, with one precomputed Gram matrix per kernel configuration
+
+The kernel matrix only depends on the kernel parameters (kernel, degree, gamma, coef0), not on `C`.
+So instead of letting every (C, fold) fit recompute it like `GridSearchCV` would, we compute the
+Gram matrix of the whole training set once per kernel configuration, and fit `SVC(kernel='precomputed')`
+on slices of it for every C value and fold. Kernel configurations are spread across all cores.
+'''
+from itertools import product
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.model_selection import StratifiedKFold
+from sklearn.svm import SVC
+
+KERNEL_GRID = {
+    'kernel': ['poly', 'rbf', 'sigmoid', 'linear'],
+    'degree': [2, 3, 4],
+    # multiples of sklearn's `gamma='scale'`, so the grid makes sense whether or not the features are standardized
+    'gamma': [0.1, 1.0, 10.0],
+    'coef0': [0.0, 1.0],
+}
+
+C_VALUES = [0.25, 0.5, 1, 2, 4, 8, 16]
+
+# some candidates (e.g. large C on unscaled features) take ages to converge,
+# cap the solver so one bad candidate can't hold up the whole search
+MAX_ITER = 100_000
+
+# parameters each kernel actually uses, so we don't evaluate identical configurations twice
+KERNEL_PARAMS = {
+    'poly': ('degree', 'gamma', 'coef0'),
+    'rbf': ('gamma',),
+    'sigmoid': ('gamma', 'coef0'),
+    'linear': (),
+}
+
+
+def kernel_configs(mode='grid', n_iter=20, seed=0) -> list:
+    '''
+    Kernel configurations to try: every one in `KERNEL_GRID` for `mode='grid'`,
+    or `n_iter` of them picked at random for `mode='random'`
+    '''
+    configs = []
+    for kernel in KERNEL_GRID['kernel']:
+        names = KERNEL_PARAMS[kernel]
+        for values in product(*(KERNEL_GRID[name] for name in names)):
+            configs.append({'kernel': kernel, **dict(zip(names, values))})
+
+    if mode == 'random' and n_iter < len(configs):
+        rng = np.random.default_rng(seed)
+        configs = [configs[i] for i in sorted(rng.choice(len(configs), n_iter, replace=False))]
+    elif mode not in ('grid', 'random'):
+        raise ValueError(f'Unknown search mode {mode!r}, expected "grid" or "random"')
+    return configs
+
+
+def resolve_gamma(X: np.ndarray, factor: float) -> float:
+    '''`factor` times SVC's `gamma='scale'`, computed on the whole training set'''
+    variance = X.var()
+    return float(factor / (X.shape[1] * variance)) if variance > 0 else factor
+
+
+def gram_matrix(X: np.ndarray, config: dict) -> np.ndarray:
+    return pairwise_kernels(X, metric=config['kernel'], **svc_params(X, config))
+
+
+def svc_params(X: np.ndarray, config: dict) -> dict:
+    '''The kernel parameters of `config` as `SVC` arguments, with the gamma factor turned into an actual gamma'''
+    params = {name: config[name] for name in KERNEL_PARAMS[config['kernel']]}
+    if 'gamma' in params:
+        params['gamma'] = resolve_gamma(X, params['gamma'])
+    return params
+
+
+def evaluate_config(X: np.ndarray, y: np.ndarray, config: dict, folds: list) -> list:
+    '''
+    Cross-validated accuracy of every C value for one kernel configuration, sharing one Gram matrix
+    '''
+    K = gram_matrix(X, config)
+
+    results = []
+    for C in C_VALUES:
+        accuracies = []
+        for train_idx, test_idx in folds:
+            model = SVC(kernel='precomputed', C=C, max_iter=MAX_ITER)
+            model.fit(K[np.ix_(train_idx, train_idx)], y[train_idx])
+            accuracies.append(np.mean(model.predict(K[np.ix_(test_idx, train_idx)]) == y[test_idx]))
+        results.append({**config, 'C': C, 'cv_accuracy': float(np.mean(accuracies))})
+    return results
+
+
+def search(X, y, mode='grid', n_iter=20, n_folds=5, n_jobs=-1, seed=0):
+    '''
+    Runs the search, returning the best SVC parameters and the scores of every candidate.
+    `n_jobs=-1` uses all cores
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed).split(X, y))
+
+    configs = kernel_configs(mode, n_iter, seed)
+    print(f'Searching {len(configs)} kernel configurations x {len(C_VALUES)} C values x {n_folds} folds')
+    per_config = Parallel(n_jobs=n_jobs)(delayed(evaluate_config)(X, y, config, folds) for config in configs)
+
+    results = [result for config_results in per_config for result in config_results]
+    best = max(results, key=lambda result: result['cv_accuracy'])
+    best_params = {'kernel': best['kernel'], 'C': best['C'], **svc_params(X, best)}
+    return best_params, best['cv_accuracy'], results
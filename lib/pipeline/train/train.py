@@ -1,21 +1,37 @@
 '''
 Trains ML model using training dataset. Saves trained model.
 '''
+import shutil
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 import mlflow
 import mlflow.sklearn
 
 from sklearn.svm import SVC
 from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
 
-from pipeline import constants
+from pipeline import compiled, constants, metrics, scaling
 
 
-def train(train_data, model_output):
+def train(
+    train_data, model_output, search='none', scaler=None,
+    candidates='none', max_latency_ms=0.0, latency_weight=0.0, engine='svc'
+):
+    '''
+    Trains an SVC on the train data.
+
+    `search` can be `'grid'` or `'random'` to pick the SVC's hyperparameters with a cross-validated search
+    (see `search.py`), or `'none'` for our default `SVC(kernel='poly', C=2)`
+
+    `candidates` can instead be `'all'` or a comma-separated list of model families (see `candidates.py`)
+    to train in parallel. The most accurate one is trained on the whole train set, optionally within
+    `max_latency_ms` per prediction and/or penalized by `latency_weight` accuracy per millisecond
+
+    `scaler` is the folder the clean stage saved its scaler to, if the train data was scaled by it.
+    It is copied into the model folder, so the endpoint can apply the same scaling to raw inputs
+    '''
     mlflow.start_run()
 
     # automatically log necessary parameters
@@ -28,12 +44,54 @@ def train(train_data, model_output):
     y_train = train_data[constants.TARGET_COL]
     X_train = train_data[constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS]
 
+    if search != 'none' and candidates != 'none':
+        raise ValueError('Use either a hyperparameter search or candidates, not both')
+    if engine not in ('svc', 'nystroem'):
+        raise ValueError(f'Unknown engine {engine!r}, expected "svc" or "nystroem"')
+    if engine != 'svc' and (search != 'none' or candidates != 'none'):
+        raise ValueError('Searches and candidates only train exact models, use them with engine="svc"')
+
     # Train a SVC Model with the training set
-    model = SVC(kernel='poly', C=2)
+    if engine == 'nystroem':
+        from pipeline.train.approximate import NystroemSGDClassifier
+        model = NystroemSGDClassifier()
+    elif search == 'none' and candidates == 'none':
+        model = SVC(kernel='poly', C=2)
+    elif candidates != 'none':
+        from pipeline.train import candidates as model_candidates
+
+        # the workers are forked from this process, don't let them autolog
+        mlflow.sklearn.autolog(disable=True)
+        results = model_candidates.train_candidates(X_train, y_train, model_candidates.parse_candidates(candidates))
+        mlflow.sklearn.autolog()
+        for result in results:
+            print(result)
+            for measure in ('accuracy', 'fit_time_s', 'predict_latency_ms'):
+                metrics.log_metric(f"candidate {result['candidate']} {measure}", result[measure])
+        mlflow.log_dict(results, "candidates.json")
+
+        best = model_candidates.select(results, max_latency_ms, latency_weight)
+        print(f"Best candidate: {best['candidate']}")
+        metrics.log_param("candidate", best['candidate'])
+        model = model_candidates.CANDIDATES[best['candidate']]()
+    else:
+        # the search pulls in joblib and more of sklearn, only import it when we search
+        from pipeline.train import search as hyperparameter_search
+
+        # don't autolog the hundreds of fits the search makes, just the final one
+        mlflow.sklearn.autolog(disable=True)
+        best_params, cv_accuracy, results = hyperparameter_search.search(X_train, y_train, mode=search)
+        mlflow.sklearn.autolog()
+        print(f'Best hyperparameters: {best_params} (cv accuracy {cv_accuracy:.3f})')
+        metrics.log_params({f"search {name}": value for name, value in best_params.items()})
+        metrics.log_metric("search cv accuracy", cv_accuracy)
+        mlflow.log_dict(results, "search_results.json")
+        model = SVC(**best_params)
 
     # log model hyperparameters
-    mlflow.log_param("model", "SVC")
-    mlflow.log_param("kernel", model.kernel) # don't mind the type errors lol
+    metrics.log_param("model", type(model).__name__)
+    if isinstance(model, SVC):
+        metrics.log_param("kernel", model.kernel) # don't mind the type errors lol
 
     # Train model with the train set
     model.fit(X_train, y_train)
@@ -49,20 +107,36 @@ def train(train_data, model_output):
     mae = mean_absolute_error(y_train, yhat_train)
     
     # log model performance metrics
-    mlflow.log_metric("train r2", r2)
-    mlflow.log_metric("train mse", mse)
-    mlflow.log_metric("train rmse", rmse)
-    mlflow.log_metric("train mae", mae)
+    metrics.log_metric("train r2", r2)
+    metrics.log_metric("train mse", mse)
+    metrics.log_metric("train rmse", rmse)
+    metrics.log_metric("train mae", mae)
 
     # Visualize results
+    # matplotlib is slow to import, so only import it once we actually plot
+    from matplotlib import pyplot as plt
     plt.scatter(y_train, yhat_train,  color='black')
     plt.plot(y_train, y_train, color='blue', linewidth=3)
     plt.xlabel("Real value")
     plt.ylabel("Predicted value")
-    plt.savefig("regression_results.png")
-    mlflow.log_artifact("regression_results.png")
+    # logged straight from memory, so nothing is left behind in the working directory
+    mlflow.log_figure(plt.gcf(), "regression_results.png")
+    plt.close()
 
     # Save the model
-    mlflow.sklearn.save_model(sk_model=model, path=model_output)
+    from pipeline.train.approximate import save_kwargs
+    mlflow.sklearn.save_model(sk_model=model, path=model_output, **save_kwargs(model))
+
+    # Save a NumPy-only copy of the model next to it, for the endpoint to load
+    # the parity of its predictions is checked on the test set in `evaluate`
+    # only SVCs (and the approximate engine) can be compiled, the endpoint serves `model.pkl` for the other candidates
+    if compiled.supports(model):
+        compiled.export(model, Path(model_output) / compiled.FILE_NAME)
+        # and a float32 copy, only registered if evaluate finds it predicts like the full-precision one
+        compiled.export(model, Path(model_output) / compiled.FLOAT32_FILE_NAME, dtype=np.float32)
+
+    if scaler is not None:
+        shutil.copy(Path(scaler) / scaling.FILE_NAME, Path(model_output) / scaling.FILE_NAME)
 
+    metrics.end()
     mlflow.end_run()
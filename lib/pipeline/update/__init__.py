@@ -0,0 +1 @@
+from .update import update
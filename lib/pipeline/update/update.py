@@ -0,0 +1,128 @@
+'''
+Updates a registered model with newly labeled rows, instead of retraining it from scratch
+
+The registered model has to be one that can be updated in place (`engine='nystroem'`, see `train/approximate.py`).
+`update()` continues training it on the new rows only, so the cost scales with the size of the delta.
+Any other model is rejected with a `ValueError` before anything is trained.
+New rows are scaled with the registered model's own scaler, so they go in raw, like requests to the endpoint.
+
+Incremental updates can drift away from what a full retrain would give, so as a safeguard the model is
+retrained from scratch on all of `train_data` every `full_retrain_every` updates, or as soon as it does
+`max_drift` worse on the new rows than on the test set. The number of updates since the last full retrain
+is kept in the model's mlflow metadata, so it carries over from one registered version to the next.
+
+This is a standalone entry point (the `update_model` component, or calling `update()`), it isn't a step of
+the pipelines in `azure/pipeline/main.py` or `local.py`.
+'''
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import mlflow
+import mlflow.sklearn
+from mlflow.models import Model
+from mlflow.tracking import MlflowClient
+
+from pipeline import compiled, constants, metrics, scaling
+
+FEATURE_COLS = constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS
+UPDATES_KEY = 'updates_since_full_retrain'
+
+
+def latest_model_uri(model_name: str) -> str:
+    '''
+    The artifacts the latest version of `model_name` was registered from: unlike `models:/` URIs,
+    they also hold the compiled model and the scaler (see `register.py`)
+    '''
+    versions = MlflowClient().search_model_versions(f"name='{model_name}'")
+    if not versions:
+        raise ValueError(f'No registered versions of {model_name} to update')
+    latest = max(versions, key=lambda version: int(version.version))
+    return f"runs:/{latest.run_id}/{model_name}"
+
+
+def update(
+    model_name, new_data, train_data, model_output, test_data=None,
+    base_model=None, full_retrain_every=10, max_drift=0.05, epochs=5
+):
+    '''
+    Updates `base_model` (the latest registered version of `model_name` by default) with the rows in
+    `new_data`, and saves it to `model_output` in the same format as the train stage.
+    All the data is raw (the prep stage's outputs): `train_data` is only read for full retrains, `test_data` to measure drift
+    '''
+    # other stages' modules are imported here rather than at the top, so importing this stage doesn't import them
+    from pipeline.clean.clean import iqr_outliers
+    from pipeline.train.approximate import NystroemSGDClassifier, save_kwargs
+
+    mlflow.start_run()
+
+    base_model = base_model or latest_model_uri(model_name)
+    print(f'Updating {base_model}')
+    metrics.log_param("base model", base_model)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_folder = Path(mlflow.artifacts.download_artifacts(artifact_uri=base_model, dst_path=tmp))
+        model = mlflow.sklearn.load_model(str(base_folder))
+        updates = int((Model.load(str(base_folder)).metadata or {}).get(UPDATES_KEY, 0))
+
+        scaler_path = base_folder / scaling.FILE_NAME
+        scaler = scaling.Standardizer.load(scaler_path) if scaler_path.exists() else None
+
+    if not isinstance(model, NystroemSGDClassifier):
+        raise ValueError(
+            f'{base_model} is a {type(model).__name__}, only models trained with engine="nystroem" '
+            '(a NystroemSGDClassifier) can be updated. Retrain it with the train component instead'
+        )
+
+    def read(folder, drop_outliers=False):
+        data = pd.read_parquet(Path(folder))
+        X = data[FEATURE_COLS].to_numpy(dtype=np.float64)
+        y = data[constants.TARGET_COL].to_numpy()
+        if drop_outliers:
+            # like the clean stage does before the first training
+            keep = ~iqr_outliers(X)
+            X, y = X[keep], y[keep]
+        return (scaler.transform(X) if scaler is not None else X), y
+
+    X_new, y_new = read(new_data)
+    metrics.log_metric("new rows", len(y_new))
+
+    # how the model does on the new cases before it has seen them, compared to the test set, is our drift
+    new_accuracy = float(np.mean(model.predict(X_new) == y_new))
+    metrics.log_metric("new rows accuracy before update", new_accuracy)
+    drift = None
+    if test_data is not None:
+        X_test, y_test = read(test_data)
+        test_accuracy = float(np.mean(model.predict(X_test) == y_test))
+        drift = test_accuracy - new_accuracy
+        metrics.log_metric("test accuracy before update", test_accuracy)
+        metrics.log_metric("accuracy drift", drift)
+        print(f'Accuracy on new rows {new_accuracy:.3f}, on the test set {test_accuracy:.3f}')
+
+    full_retrain = updates + 1 >= full_retrain_every or (drift is not None and drift > max_drift)
+    metrics.log_param("full retrain", full_retrain)
+    if full_retrain:
+        print(f'Retraining from scratch ({updates} updates since the last full retrain, drift {drift})')
+        X_train, y_train = read(train_data, drop_outliers=True)
+        # the new rows may or may not already be in the train data, they're labeled cases either way
+        model = NystroemSGDClassifier(**model.get_params()).fit(np.vstack([X_train, X_new]), np.concatenate([y_train, y_new]))
+        updates = 0
+    else:
+        model.partial_fit(X_new, y_new, epochs=epochs)
+        updates += 1
+
+    metrics.log_metric("new rows accuracy after update", float(np.mean(model.predict(X_new) == y_new)))
+    if test_data is not None:
+        metrics.log_metric("test accuracy after update", float(np.mean(model.predict(X_test) == y_test)))
+    metrics.log_metric("updates since full retrain", updates)
+
+    mlflow.sklearn.save_model(sk_model=model, path=model_output, metadata={UPDATES_KEY: updates}, **save_kwargs(model))
+    compiled.export(model, Path(model_output) / compiled.FILE_NAME)
+    compiled.export(model, Path(model_output) / compiled.FLOAT32_FILE_NAME, dtype=np.float32)
+    # the model still expects inputs scaled like before, keep the scaler with it
+    if scaler is not None:
+        scaler.save(Path(model_output) / scaling.FILE_NAME)
+
+    metrics.end()
+    mlflow.end_run()
@@ -0,0 +1,91 @@
+'''
+Ingestion watermark for incremental prep
+
+Saved as `_watermark.json` in the train data folder, it records which raw files have already been
+split (with a checksum of each), how many partitions have been written, and a hash of the schema
+in `constants.py`. The leading underscore makes pandas/pyarrow skip it when reading the folder.
+
+`batch_score` lists and checksums its input files the same way, so this is shared rather than part of the prep stage.
+'''
+import hashlib
+import json
+from pathlib import Path
+
+from . import constants
+
+FILE_NAME = '_watermark.json'
+
+
+def schema_hash(splits) -> str:
+    '''Hash of everything that changes what prep writes: the columns, and how rows are split'''
+    schema = [
+        constants.NUMERIC_COLS, constants.CAT_NOM_COLS, constants.CAT_ORD_COLS,
+        constants.TARGET_COL, constants.ID_COL, splits
+    ]
+    return hashlib.sha256(json.dumps(schema).encode()).hexdigest()
+
+
+def raw_files(raw_data) -> dict:
+    '''
+    The raw parquet file(s), keyed by their path relative to `raw_data`.
+    Mount paths change from job to job, so they can't be used as keys
+    '''
+    raw_data = Path(raw_data)
+    if raw_data.is_file():
+        return {raw_data.name: raw_data}
+    return {path.relative_to(raw_data).as_posix(): path for path in sorted(raw_data.rglob('*.parquet'))}
+
+
+def checksum(path: Path) -> str:
+    '''
+    SHA-256 of a parquet file's size and footer. The footer holds the offsets and statistics of every
+    column chunk, so any change to the data changes it, and we don't have to read the whole file
+    '''
+    with open(path, 'rb') as file:
+        size = file.seek(0, 2)
+        # a parquet file ends with the footer, its 4 byte length, and the `PAR1` magic bytes
+        file.seek(size - 8)
+        footer_length = int.from_bytes(file.read(4), 'little')
+        file.seek(size - 8 - footer_length)
+        footer = file.read(footer_length)
+
+    digest = hashlib.sha256(str(size).encode())
+    digest.update(footer)
+    return digest.hexdigest()
+
+
+def load(folder: Path):
+    try:
+        return json.loads((Path(folder) / FILE_NAME).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def save(folder: Path, schema: str, files: dict, parts: int):
+    state = {'schema': schema, 'files': files, 'parts': parts}
+    (Path(folder) / FILE_NAME).write_text(json.dumps(state, indent=2))
+
+
+def rebuild_reason(state, schema: str, files: dict):
+    '''
+    Why the existing splits can't just be appended to, or `None` if they can.
+    `files` maps the current raw files to their checksums
+    '''
+    if state is None:
+        return 'no watermark found'
+    if state['schema'] != schema:
+        return 'the schema in constants.py changed'
+    for name, file_checksum in state['files'].items():
+        if name not in files:
+            return f'raw file {name} was removed'
+        if files[name] != file_checksum:
+            return f'raw file {name} was modified'
+    return None
+
+
+def clear(folders):
+    '''Deletes the existing split partitions and watermark'''
+    for folder in folders:
+        for path in Path(folder).glob('*.parquet'):
+            path.unlink()
+        (Path(folder) / FILE_NAME).unlink(missing_ok=True)
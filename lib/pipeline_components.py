@@ -28,9 +28,63 @@ def prep(
     raw_data: Input(type="uri_file"),
     train_data: Output(type="uri_folder"),
     val_data: Output(type="uri_folder"),
-    test_data: Output(type="uri_folder")
+    test_data: Output(type="uri_folder"),
+    # read and split the raw data in batches, for datasets that don't fit in memory
+    streaming: bool = False,
+    # only split raw files that are new since the last run, see `pipeline/watermark.py`
+    incremental: bool = False
 ):
-    pipeline.prep(raw_data, train_data, val_data, test_data)
+    pipeline.load_stage('prep')(raw_data, train_data, val_data, test_data, streaming, incremental)
+
+
+@command_component(
+    name="prep_data_incremental",
+    display_name="Prep Data (Incremental)",
+    description="Splits only the raw parquet files added to a folder since the last run, appending to the previous splits",
+    environment={
+        'conda_file': f'{Path(__file__).parent}/pipeline/prep/conda.yaml',
+        'image': 'mcr.microsoft.com/azureml/minimal-ubuntu20.04-py38-cpu-inference',
+    },
+    code='.', # view the entire lib folder
+    # the raw folder and the splits change between runs under the same paths, never reuse a previous run's outputs
+    is_deterministic=False
+)
+def prep_incremental(
+    # a folder of raw parquet files, see `pipeline/prep/README.md`
+    raw_data: Input(type="uri_folder"),
+    # the previous run's splits, with their `_watermark.json`, so these must be at the same paths every run
+    train_data: Output(type="uri_folder"),
+    val_data: Output(type="uri_folder"),
+    test_data: Output(type="uri_folder"),
+):
+    pipeline.load_stage('prep')(raw_data, train_data, val_data, test_data, incremental=True)
+
+
+@command_component(
+    name="clean_data",
+    display_name="Clean Data",
+    description="Removes outliers from the training data, standardizes every split and saves the scaler",
+    environment={
+        'conda_file': f'{Path(__file__).parent}/pipeline/clean/conda.yaml',
+        'image': 'mcr.microsoft.com/azureml/minimal-ubuntu20.04-py38-cpu-inference',
+    }
+)
+def clean(
+    train_data: Input(type="uri_folder"),
+    val_data: Input(type="uri_folder"),
+    test_data: Input(type="uri_folder"),
+    clean_train_data: Output(type="uri_folder"),
+    clean_val_data: Output(type="uri_folder"),
+    clean_test_data: Output(type="uri_folder"),
+    scaler_output: Output(type="uri_folder"),
+    # 'iqr', 'lof' or 'none', see `pipeline/clean/clean.py`
+    method: str = 'iqr'
+):
+    pipeline.load_stage('clean')(
+        train_data, val_data, test_data,
+        clean_train_data, clean_val_data, clean_test_data, scaler_output,
+        method
+    )
 
 
 @command_component(
@@ -44,9 +98,49 @@ def prep(
 )
 def train(
     train_data: Input(type="uri_folder"),
-    model_output: Output(type="uri_folder")
+    model_output: Output(type="uri_folder"),
+    # the scaler fitted by the clean component, saved with the model so the endpoint can take raw inputs
+    scaler: Input(type="uri_folder", optional=True) = None,
+    # 'none', 'grid' or 'random', see `pipeline/train/search.py`
+    search: str = 'none',
+    # 'none', 'all' or a comma-separated list of model families, see `pipeline/train/candidates.py`
+    candidates: str = 'none',
+    # only pick candidates that predict a row within this many ms (0 for no budget)
+    max_latency_ms: float = 0.0,
+    # accuracy a candidate has to gain to be worth 1ms more latency
+    latency_weight: float = 0.0,
+    # 'svc', or 'nystroem' for the approximate-kernel engine, see `pipeline/train/approximate.py`
+    engine: str = 'svc'
 ):
-    pipeline.train(train_data, model_output)
+    pipeline.load_stage('train')(train_data, model_output, search, scaler, candidates, max_latency_ms, latency_weight, engine)
+
+
+@command_component(
+    name="update_model",
+    display_name="Update Model",
+    description='Updates the latest registered model with newly labeled rows, retraining it from scratch when due.',
+    environment={
+        'conda_file': f'{Path(__file__).parent}/pipeline/update/conda.yaml',
+        'image': 'mcr.microsoft.com/azureml/minimal-ubuntu20.04-py38-cpu-inference',
+    }
+)
+def update(
+    # newly labeled rows, raw like the prep component's outputs
+    new_data: Input(type="uri_folder"),
+    # all the raw training data, only read for full retrains
+    train_data: Input(type="uri_folder"),
+    model_output: Output(type="uri_folder"),
+    # raw test data, to measure how much worse the model does on the new rows
+    test_data: Input(type="uri_folder", optional=True) = None,
+    # retrain from scratch every this many updates, see `pipeline/update/update.py`
+    full_retrain_every: int = 10,
+    # or as soon as the model is this much less accurate on the new rows than on the test data
+    max_drift: float = 0.05
+):
+    pipeline.load_stage('update')(
+        "wisconsin-BCa-model", new_data, train_data, model_output, test_data,
+        full_retrain_every=full_retrain_every, max_drift=max_drift
+    )
 
 
 @command_component(
@@ -61,9 +155,16 @@ def train(
 def evaluate(
     model_input: Input(type="uri_folder"),
     test_data: Input(type="uri_folder"),
-    evaluation_output: Output(type="uri_folder")
+    evaluation_output: Output(type="uri_folder"),
+    # the test split before scaling, which the registered versions are compared on (each with its own scaler)
+    raw_test_data: Input(type="uri_folder", optional=True) = None,
+    # share of test rows the float32 model may predict differently, or it isn't registered
+    max_float32_mismatch_rate: float = 0.0
 ):
-    pipeline.evaluate("wisconsin-BCa-model", model_input, test_data, evaluation_output)
+    pipeline.load_stage('evaluate')(
+        "wisconsin-BCa-model", model_input, test_data, evaluation_output,
+        max_float32_mismatch_rate=max_float32_mismatch_rate, raw_test_data=raw_test_data
+    )
 
 
 @command_component(
@@ -80,4 +181,31 @@ def register(
     evaluation_output: Input(type="uri_folder"),
     model_info_output_path: Output(type="uri_folder")
 ):
-    pipeline.register("wisconsin-BCa-model", model_path, evaluation_output, model_info_output_path)
+    pipeline.load_stage('register')("wisconsin-BCa-model", model_path, evaluation_output, model_info_output_path)
+
+
+@command_component(
+    name="batch_score",
+    display_name="Batch Score",
+    description='Scores a large parquet dataset with a registered model, chunk by chunk across processes. Resumes interrupted runs.',
+    environment={
+        'conda_file': f'{Path(__file__).parent}/pipeline/batch_score/conda.yaml',
+        'image': 'mcr.microsoft.com/azureml/minimal-ubuntu20.04-py38-cpu-inference',
+    }
+)
+def batch_score(
+    # raw cases to score, a parquet file or a folder of them
+    input_data: Input(type="uri_folder"),
+    # point it at the same datastore path to resume an interrupted run, see `pipeline/batch_score/batch_score.py`
+    predictions_output: Output(type="uri_folder"),
+    # the model folder to score with, the latest registered version by default
+    model_input: Input(type="uri_folder", optional=True) = None,
+    # worker processes, 0 for one per core
+    processes: int = 0,
+    # parquet row groups scored (and written) together
+    row_groups_per_chunk: int = 1
+):
+    pipeline.load_stage('batch_score')(
+        "wisconsin-BCa-model", input_data, predictions_output, model_input,
+        processes=processes, row_groups_per_chunk=row_groups_per_chunk
+    )
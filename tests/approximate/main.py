@@ -0,0 +1,99 @@
+'''
+Benchmark of the approximate-kernel training engine against the exact SVC
+
+Scales the training data up to each of `--sizes` rows (resampling the real training rows with a bit of
+Gaussian noise), fits both engines on it, and reports their fit time, compiled model size,
+predict latency and accuracy on held-out real rows. See `README.md` in this folder for usage.
+'''
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+from sklearn.svm import SVC
+
+from pipeline import compiled, constants
+from pipeline.scaling import Standardizer
+from pipeline.train.approximate import NystroemSGDClassifier
+
+ROOT = Path(__file__).resolve().parents[2]
+
+ENGINES = {
+    'svc': lambda: SVC(kernel='poly', C=2),
+    'nystroem': lambda: NystroemSGDClassifier(),
+}
+
+
+def scale_up(X: np.ndarray, y: np.ndarray, size: int, noise: float, rng) -> tuple:
+    rows = rng.integers(0, len(X), size)
+    return X[rows] + rng.normal(0, noise, (size, X.shape[1])), y[rows]
+
+
+def latency_ms(model, X: np.ndarray, samples=200) -> float:
+    latencies = []
+    for i in range(samples):
+        row = X[i % len(X)][None, :]
+        start = time.perf_counter()
+        model.predict(row)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+def benchmark(engine: str, X_train, y_train, X_test, y_test) -> dict:
+    model = ENGINES[engine]()
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    # time the model the way the endpoint serves it
+    with tempfile.TemporaryDirectory() as tmp:
+        served = compiled.CompiledSVC.load(compiled.export(model, Path(tmp) / compiled.FILE_NAME))
+
+    batch = X_test[np.arange(1000) % len(X_test)]
+    start = time.perf_counter()
+    served.predict(batch)
+    batch_time = time.perf_counter() - start
+
+    return {
+        'fit_s': fit_time,
+        # support vectors for the SVC, landmarks for the approximate engine
+        'vectors': len(served.support_vectors),
+        'latency_ms': latency_ms(served, X_test),
+        'rows_per_s': len(batch) / batch_time,
+        'accuracy': float(np.mean(served.predict(X_test) == y_test)),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', type=Path, default=ROOT / 'data' / 'cleaned-wisconsin-lof.parquet',
+                        help='parquet file to scale up and test on')
+    parser.add_argument('--sizes', default='1000,5000,20000', help='comma-separated numbers of training rows')
+    parser.add_argument('--engines', default='svc,nystroem', help='comma-separated engines to compare')
+    parser.add_argument('--noise', type=float, default=0.1, help='std of the noise added to resampled (scaled) rows')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = np.random.default_rng(0)
+
+    data = pd.read_parquet(args.data)
+    X = data[constants.NUMERIC_COLS].to_numpy(dtype=np.float64)
+    y = data[constants.TARGET_COL].to_numpy()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, stratify=y, random_state=0)
+    scaler = Standardizer.fit(X_train, constants.NUMERIC_COLS)
+    X_train, X_test = scaler.transform(X_train), scaler.transform(X_test)
+
+    print(f'{"rows":>7} {"engine":<9} {"fit":>9} {"vectors":>8} {"latency":>9} {"rows/s":>10} {"accuracy":>9}')
+    for size in [int(s) for s in args.sizes.split(',')]:
+        X_big, y_big = scale_up(X_train, y_train, size, args.noise, rng)
+        for engine in args.engines.split(','):
+            result = benchmark(engine, X_big, y_big, X_test, y_test)
+            print(
+                f'{size:>7} {engine:<9} {result["fit_s"]:>8.2f}s {result["vectors"]:>8} '
+                f'{result["latency_ms"]:>7.3f}ms {result["rows_per_s"]:>10.0f} {result["accuracy"]:>9.3f}'
+            )
@@ -0,0 +1,87 @@
+'''
+Checks that the modules copied into `azure/deploy` still match the originals in `lib/pipeline`
+
+Only the `azure/deploy` folder is uploaded with the scoring script, so it has its own copies of
+`CompiledSVC`, `Standardizer` and the feature columns. This compares the syntax trees (so comments
+and formatting don't matter) of every function, class, method and constant in each copy with the
+original, and fails if any differ, or if the original gained something that isn't in the copy
+and isn't listed in `LIB_ONLY`.
+'''
+import ast
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'lib'))
+sys.path.insert(0, str(ROOT / 'azure' / 'deploy'))
+
+import payloads  # noqa: E402
+from pipeline import constants  # noqa: E402
+
+# original -> copy
+COPIES = {
+    'lib/pipeline/compiled.py': 'azure/deploy/compiled_model.py',
+    'lib/pipeline/scaling.py': 'azure/deploy/scaling.py',
+}
+
+# what the endpoint doesn't need, and only the originals have (`Class.method` for methods)
+LIB_ONLY = {
+    'lib/pipeline/compiled.py': {'SUPPORTED_KERNELS', 'supports', 'export'},
+    'lib/pipeline/scaling.py': {'Standardizer.fit', 'Standardizer.save', 'Standardizer.inverse_transform'},
+}
+
+
+def definitions(path: str) -> dict:
+    '''The top-level functions, classes and constants of a module, with the methods of its classes as `Class.method`'''
+    tree = ast.parse((ROOT / path).read_text())
+    found = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            found[node.name] = node
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            found[node.targets[0].id] = node
+        if isinstance(node, ast.ClassDef):
+            found.update({f'{node.name}.{item.name}': item for item in node.body if isinstance(item, ast.FunctionDef)})
+    return found
+
+
+def compare(original: str, copy: str) -> list:
+    '''The names that differ between `original` and `copy`'''
+    lib, deploy = definitions(original), definitions(copy)
+    problems = []
+    for name, node in deploy.items():
+        if name not in lib:
+            problems.append(f'{name} is only in {copy}')
+            continue
+        if isinstance(node, ast.ClassDef):
+            # the methods are compared one by one, a class only has to have the same docstring and bases
+            same = ast.get_docstring(node) == ast.get_docstring(lib[name]) and \
+                ast.dump(ast.Tuple(node.bases)) == ast.dump(ast.Tuple(lib[name].bases))
+        else:
+            same = ast.dump(node) == ast.dump(lib[name])
+        if not same:
+            problems.append(f'{name} differs')
+    for name in lib.keys() - deploy.keys() - LIB_ONLY[original]:
+        problems.append(f'{name} is missing from {copy}')
+    return problems
+
+
+if __name__ == '__main__':
+    failed = False
+    for original, copy in COPIES.items():
+        problems = compare(original, copy)
+        for problem in problems:
+            print(f'{copy}: {problem}')
+        failed = failed or bool(problems)
+        if not problems:
+            print(f'ok: {copy} matches {original}')
+
+    feature_cols = tuple(constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS)
+    if payloads.FEATURE_COLS == feature_cols:
+        print('ok: azure/deploy/payloads.py FEATURE_COLS matches lib/pipeline/constants.py')
+    else:
+        print('azure/deploy/payloads.py: FEATURE_COLS differs from lib/pipeline/constants.py')
+        failed = True
+
+    if failed:
+        raise SystemExit('The copies in azure/deploy are out of sync, update them from lib/pipeline')
@@ -0,0 +1,65 @@
+'''
+Checks that `resolve_resources()` in `lib/deploy_helpers.py` runs its lookups concurrently,
+using a fake `MLClient` with artificial latencies instead of Azure
+'''
+import time
+from types import SimpleNamespace
+
+import deploy_helpers as helper
+
+# seconds each fake remote call takes
+LIST_LATENCY = 0.5
+GET_LATENCY = 0.5
+ENDPOINT_CREATION_LATENCY = 2.0
+
+
+class FakeModels:
+    def list(self, name):
+        time.sleep(LIST_LATENCY)
+        return [SimpleNamespace(version='1'), SimpleNamespace(version='2')]
+
+    def get(self, name, version):
+        time.sleep(GET_LATENCY)
+        return SimpleNamespace(name=name, version=version)
+
+
+class FakeEnvironments:
+    def list(self, name):
+        time.sleep(LIST_LATENCY)
+        return [SimpleNamespace(version='3')]
+
+    def get(self, name, version):
+        time.sleep(GET_LATENCY)
+        return SimpleNamespace(name=name, version=version)
+
+
+class FakeOnlineEndpoints:
+    def get(self, name, local):
+        time.sleep(GET_LATENCY)
+        raise Exception('Endpoint not found')
+
+    def begin_create_or_update(self, endpoint, local=False):
+        # like `LROPoller.result()`, blocks until the endpoint is created
+        def result():
+            time.sleep(ENDPOINT_CREATION_LATENCY)
+            return endpoint
+        return SimpleNamespace(result=result)
+
+
+class FakeMLClient:
+    models = FakeModels()
+    environments = FakeEnvironments()
+    online_endpoints = FakeOnlineEndpoints()
+
+
+if __name__ == '__main__':
+    model, environment, endpoint = helper.resolve_resources(FakeMLClient(), local=False)
+    helper.print_timings()
+
+    assert (model.version, environment.version, endpoint.name) == ('2', '3', helper.constants.ENDPOINT_NAME)
+
+    sequential = sum(seconds for phase, seconds in helper.TIMINGS.items() if phase != 'resolve_resources')
+    concurrent = helper.TIMINGS['resolve_resources']
+    print(f'Sequential would take {sequential:.1f}s, concurrent took {concurrent:.1f}s')
+    # the slowest phase (creating the endpoint) should be the only one we wait for
+    assert concurrent < sequential * 0.8, 'resolve_resources() did not run its lookups concurrently'
@@ -5,12 +5,14 @@ import deploy_helpers as helper
 
 if __name__ == '__main__':
     client = helper.get_mlclient()
-    model = helper.get_latest_model(client, local=True)
-    environment = helper.ml_environment(client, local=True)
-    endpoint = helper.create_or_update_endpoint(client, local=True)
-    deployment_name = helper.create_or_update_deployment(client, model, environment, endpoint, local=True)
+    # model, environment and endpoint are resolved concurrently
+    model, environment, endpoint = helper.resolve_resources(client, local=True)
+    with helper.timed('create_or_update_deployment'):
+        deployment_name = helper.create_or_update_deployment(client, model, environment, endpoint, local=True)
 
-    helper.post_deployment(client, deployment_name, local=True)
+    with helper.timed('post_deployment'):
+        helper.post_deployment(client, deployment_name, local=True)
+    helper.print_timings()
 
     # delete the endpoint
     print(f'Deleting endpoint {constants.ENDPOINT_NAME}')
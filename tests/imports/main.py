@@ -0,0 +1,122 @@
+'''
+Import time benchmark for the pipeline components
+
+Starts a fresh interpreter for every component, imports its stage the way `lib/pipeline_components.py`
+does (`pipeline.load_stage('<stage>')`), and reports the median cold-start import time, along with the
+packages that took the longest to import. See `README.md` in this folder for usage.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+STAGES = ['prep', 'clean', 'train', 'update', 'evaluate', 'register', 'batch_score']
+
+# stages importing each other's subpackages, after which `load_stage()` must still return every stage function
+IMPORT_ORDERS = [
+    ['update', 'train'],
+    ['train', 'clean'],
+    ['train', 'update', 'clean'],
+    ['batch_score', 'update', 'prep'],
+]
+
+# printed to stderr right before the measured import, so `-X importtime` lines for interpreter startup can be skipped
+MARKER = '--- measured import ---'
+
+
+def run(statement: str, importtime=False) -> subprocess.CompletedProcess:
+    code = (
+        'import sys, time\n'
+        f'sys.stderr.write({MARKER!r} + "\\n")\n'
+        'start = time.perf_counter()\n'
+        f'{statement}\n'
+        'print(time.perf_counter() - start)\n'
+    )
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [str(ROOT / 'lib'), os.getenv('PYTHONPATH')]))}
+    return subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+
+
+def heaviest_packages(stderr: str, top: int) -> list:
+    '''Top-level packages first imported by the measured statement, by cumulative import time'''
+    packages = []
+    for line in stderr.split(MARKER, 1)[1].splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        # our own packages just add up their dependencies
+        if '.' not in name and name not in ('pipeline', 'pipeline_components'):
+            packages.append((name, int(cumulative) / 1000))
+    return sorted(packages, key=lambda package: package[1], reverse=True)[:top]
+
+
+def check_import_order(order: list):
+    '''
+    Imports the stages in `order` in a fresh interpreter, then the modules stages only import when they run
+    (like `batch_score` importing `pipeline.update.update`). Checks `load_stage()` still returns every stage function
+    '''
+    run(
+        'import inspect, pipeline\n'
+        f'for name in {order!r}:\n'
+        '    pipeline.load_stage(name)\n'
+        'import pipeline.clean.clean, pipeline.update.update\n'
+        'wrong = [name for name in pipeline.STAGES if not inspect.isfunction(pipeline.load_stage(name))]\n'
+        'assert not wrong, f"not functions: {wrong}"'
+    )
+
+
+def measure(statement: str, repeats: int, top: int) -> dict:
+    times = [float(run(statement).stdout.strip().splitlines()[-1]) * 1000 for _ in range(repeats)]
+    return {
+        'statement': statement,
+        'median_ms': statistics.median(times),
+        'min_ms': min(times),
+        'max_ms': max(times),
+        'heaviest': heaviest_packages(run(statement, importtime=True).stderr, top),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated stages to measure')
+    parser.add_argument('--repeats', type=int, default=5, help='fresh interpreters to time each import in')
+    parser.add_argument('--top', type=int, default=5, help='number of heaviest packages to list per stage')
+    parser.add_argument('--output', type=Path, help='also write the results as JSON to this file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    targets = {'(package)': 'import pipeline'}
+    try:
+        # the components module needs mldesigner, which isn't in every environment
+        run('import mldesigner')
+        targets['(components)'] = 'import pipeline_components'
+    except subprocess.CalledProcessError:
+        print('mldesigner is not installed, skipping `import pipeline_components`')
+    for stage in args.stages.split(','):
+        targets[stage] = f'import pipeline; pipeline.load_stage({stage!r})'
+
+    for order in IMPORT_ORDERS:
+        try:
+            check_import_order(order)
+        except subprocess.CalledProcessError as err:
+            raise SystemExit(f'Importing {" then ".join(order)} broke the stage functions:\n{err.stderr}')
+    print(f'{len(IMPORT_ORDERS)} import orders leave every stage loadable')
+
+    results = {}
+    for name, statement in targets.items():
+        results[name] = result = measure(statement, args.repeats, args.top)
+        heaviest = ', '.join(f'{package} {ms:.0f}ms' for package, ms in result['heaviest'])
+        print(f'{name:<14} {result["median_ms"]:>8.0f}ms  (min {result["min_ms"]:.0f}ms, max {result["max_ms"]:.0f}ms)  {heaviest}')
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({'python': sys.version, 'results': results}, indent=2))
+        print(f'Results written to {args.output}')
@@ -0,0 +1,114 @@
+'''
+Overhead check of the scoring script's request instrumentation (`azure/deploy/instrumentation.py`)
+
+Times the instrumentation calls a request makes on their own (start, three phase marks, finish),
+then scores the same requests through `score.run()` with `SCORE_METRICS` on and off, and checks
+that every request was counted. Prints the Prometheus output at the end.
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+# importing the inference server makes `azureml.contrib.services` (used by `score.py`) importable
+import azureml_inference_server_http.server  # pylint: disable=unused-import
+from flask import Request
+from sklearn.svm import SVC
+from werkzeug.test import EnvironBuilder
+
+from pipeline import compiled, constants
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'azure' / 'deploy'))
+
+import instrumentation  # noqa: E402
+
+
+def instrumentation_cost(n: int, trace_sample_rate: float) -> float:
+    '''Seconds per request spent in the instrumentation calls alone'''
+    metrics = instrumentation.RequestMetrics(trace_sample_rate)
+    start = time.perf_counter()
+    for _ in range(n):
+        trace = metrics.start()
+        trace.mark('parse')
+        trace.rows = 1
+        trace.mark('predict')
+        trace.mark('serialize')
+        metrics.finish(trace)
+    return (time.perf_counter() - start) / n
+
+
+def time_requests(score, bodies: list) -> float:
+    '''Seconds per `score.run()` call, over one pass over `bodies`'''
+    # `run()` reads the body without caching it, so every pass needs new requests
+    requests = [
+        Request(EnvironBuilder(path='/score', method='POST', data=body, content_type='application/json').get_environ())
+        for body in bodies
+    ]
+    start = time.perf_counter()
+    for request in requests:
+        score.run(request)
+    return (time.perf_counter() - start) / len(requests)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', type=Path, default=ROOT / 'data' / 'cleaned-wisconsin-lof.parquet',
+                        help='parquet file to train on and take request rows from')
+    parser.add_argument('--iterations', type=int, default=100000, help='iterations of the instrumentation-only loop')
+    parser.add_argument('--requests', type=int, default=500, help='distinct requests sent to `score.run()`')
+    parser.add_argument('--repeats', type=int, default=5, help='passes over the requests, the median is reported')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    for rate in (0.0, 1.0):
+        cost = instrumentation_cost(args.iterations, rate)
+        print(f'instrumentation only (trace sample rate {rate}): {cost * 1e6:.2f}us per request')
+
+    data = pd.read_parquet(args.data)
+    X = data[constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS].to_numpy()
+    rng = np.random.default_rng(0)
+    bodies = [json.dumps({'data': X[rng.integers(0, len(X), 1)].tolist()}).encode() for _ in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_folder = Path(tmp) / 'wisconsin-BCa-model'
+        model_folder.mkdir()
+        model = SVC(kernel='poly', C=2).fit(X, data[constants.TARGET_COL])
+        joblib.dump(model, model_folder / 'model.pkl')
+        compiled.export(model, model_folder / compiled.FILE_NAME)
+        os.environ['AZUREML_MODEL_DIR'] = tmp
+
+        import score
+        score.init()
+        metrics = score.METRICS
+        # alternate between the two, so neither gets all the warm caches
+        passes = {True: [], False: []}
+        for _ in range(args.repeats):
+            for enabled in (True, False):
+                score.METRICS = metrics if enabled else None
+                passes[enabled].append(time_requests(score, bodies))
+        score.METRICS = metrics
+        with_metrics, without_metrics = float(np.median(passes[True])), float(np.median(passes[False]))
+
+    print(f'score.run() with metrics:    {with_metrics * 1e6:.1f}us per request')
+    print(f'score.run() without metrics: {without_metrics * 1e6:.1f}us per request')
+    print(f'overhead: {(with_metrics - without_metrics) * 1e6:.1f}us per request')
+
+    counted = metrics.latency['total'].count
+    expected = args.requests * args.repeats
+    assert counted == expected, f'expected {expected} requests to be counted, got {counted}'
+    assert not metrics.errors, f'unexpected errors: {metrics.errors}'
+
+    start = time.perf_counter()
+    output = metrics.render()
+    print(f'\nrender() took {(time.perf_counter() - start) * 1000:.2f}ms\n')
+    print(output)
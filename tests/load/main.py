@@ -0,0 +1,294 @@
+'''
+Local load test for the scoring script (`azure/deploy/score.py`)
+
+Trains a model like `lib/pipeline/train/train.py` does, loads it with `score.init()`,
+and serves `score.run()` behind an in-process HTTP server, so we can measure the endpoint
+without Azure or Docker. See `README.md` in this folder for usage.
+'''
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+# importing the inference server makes `azureml.contrib.services` (used by `score.py`) importable
+import azureml_inference_server_http.server  # pylint: disable=unused-import
+from flask import Request
+from sklearn.svm import SVC
+from werkzeug.test import EnvironBuilder
+
+from pipeline import compiled, constants
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'azure' / 'deploy'))
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'records': 'application/json',
+    'npy': 'application/x-npy',
+}
+
+
+def train_local_model(data_path: Path, model_dir: Path):
+    '''
+    Trains the same model as the train component, and saves it where `score.init()` expects it
+    '''
+    data = pd.read_parquet(data_path)
+    X = data[constants.NUMERIC_COLS + constants.CAT_NOM_COLS + constants.CAT_ORD_COLS]
+    model = SVC(kernel='poly', C=2).fit(X.to_numpy(), data[constants.TARGET_COL])
+
+    model_folder = model_dir / 'wisconsin-BCa-model'
+    model_folder.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, model_folder / 'model.pkl')
+    compiled.export(model, model_folder / compiled.FILE_NAME)
+    compiled.export(model, model_folder / compiled.FLOAT32_FILE_NAME, dtype=np.float32)
+
+
+def encode(rows: np.ndarray, fmt: str) -> bytes:
+    '''Encodes rows as a request body, see `azure/deploy/payloads.py`'''
+    if fmt == 'json':
+        return json.dumps({'data': rows.tolist()}).encode()
+    if fmt == 'records':
+        return json.dumps({'data': [dict(zip(constants.NUMERIC_COLS, row)) for row in rows.tolist()]}).encode()
+    buffer = io.BytesIO()
+    np.save(buffer, rows)
+    return buffer.getvalue()
+
+
+class PhaseTimer:
+    '''
+    Collects server-side parse/predict/serialize timings of every request.
+
+    `ServedModel.predict` (see `azure/deploy/models.py`) is wrapped to time the model call alone.
+    Everything in `score.run` before it (decoding and validating the body) counts as parsing, and everything
+    after it (converting the predictions to a list, and encoding the JSON response) as serializing
+    '''
+
+    def __init__(self, models):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.samples = []
+
+        predict = models.ServedModel.predict
+        local = self.local
+
+        def timed_predict(served, data):
+            start = time.perf_counter()
+            try:
+                return predict(served, data)
+            finally:
+                # the shadow model predicts in its own thread, outside of any request
+                if getattr(local, 'timing', False):
+                    local.predict_start = start
+                    local.predict_end = time.perf_counter()
+
+        models.ServedModel.predict = timed_predict
+
+    def start(self):
+        self.local.timing = True
+        self.local.start = time.perf_counter()
+        self.local.predict_start = self.local.predict_end = None
+
+    def record(self, run_end: float, response_end: float):
+        self.local.timing = False
+        local = self.local
+        if local.predict_start is None:
+            # rejected before reaching the model
+            local.predict_start = local.predict_end = run_end
+        with self.lock:
+            self.samples.append((
+                local.predict_start - local.start,
+                local.predict_end - local.predict_start,
+                response_end - local.predict_end,
+            ))
+
+    def reset(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+        return np.array(samples).reshape(-1, 3)
+
+
+def serve(score, timer: PhaseTimer) -> ThreadingHTTPServer:
+    '''
+    Starts an HTTP server on a free local port that hands requests to `score.run()`,
+    like the Azure ML inference server does for `@rawhttp` scoring scripts
+    '''
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # otherwise Nagle's algorithm adds ~40ms to every keep-alive response
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            request = Request(EnvironBuilder(
+                path='/score', method='POST', data=body,
+                headers={'Content-Type': self.headers.get('Content-Type', '')}
+            ).get_environ())
+
+            timer.start()
+            result = score.run(request)
+            run_end = time.perf_counter()
+            response = json.dumps(result).encode()
+            timer.record(run_end, time.perf_counter())
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            # don't print a line per request
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def drive(port: int, bodies: list, content_type: str, concurrency: int, n_requests: int) -> np.ndarray:
+    '''
+    Sends `n_requests` requests from `concurrency` threads, each with its own keep-alive connection.
+    Returns the client-side latency of every request, in seconds
+    '''
+    def worker(worker_id: int) -> list:
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        connection.connect()
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        latencies = []
+        for i in range(worker_id, n_requests, concurrency):
+            start = time.perf_counter()
+            connection.request('POST', '/score', body=bodies[i % len(bodies)], headers={'Content-Type': content_type})
+            response = connection.getresponse()
+            payload = response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200 or not payload.startswith(b'['):
+                raise RuntimeError(f'Bad response from the scoring script: {payload[:200]!r}')
+        connection.close()
+        return latencies
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return np.array([latency for latencies in pool.map(worker, range(concurrency)) for latency in latencies])
+
+
+def percentiles(seconds: np.ndarray) -> dict:
+    ms = seconds * 1000
+    return {
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', type=Path, default=ROOT / 'data' / 'cleaned-wisconsin-lof.parquet',
+                        help='parquet file to train on and take request rows from')
+    parser.add_argument('--model-dir', type=Path,
+                        help='use an existing model folder (containing `wisconsin-BCa-model/`) instead of training one')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated numbers of concurrent clients')
+    parser.add_argument('--batch-sizes', default='1,32,256', help='comma-separated numbers of rows per request')
+    parser.add_argument('--format', choices=list(CONTENT_TYPES), default='json', help='request body format')
+    parser.add_argument('--requests', type=int, default=500, help='requests per concurrency/batch size setting')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests before each setting')
+    parser.add_argument('--output', type=Path, help='where to write the JSON results (default: tests/load/results/)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir
+        if model_dir is None:
+            model_dir = Path(tmp)
+            print(f'Training a local model on {args.data}')
+            train_local_model(args.data, model_dir)
+        os.environ['AZUREML_MODEL_DIR'] = str(model_dir)
+
+        import models
+        import score
+        score.init()
+
+        timer = PhaseTimer(models)
+        server = serve(score, timer)
+        port = server.server_address[1]
+        print(f'Scoring script served at http://127.0.0.1:{port}/score')
+
+        rows = pd.read_parquet(args.data)[constants.NUMERIC_COLS].to_numpy()
+        rng = np.random.default_rng(0)
+
+        results = []
+        for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+            # a handful of distinct bodies, so we don't always score the exact same rows
+            bodies = [encode(rows[rng.integers(0, len(rows), batch_size)], args.format) for _ in range(16)]
+            for concurrency in [int(c) for c in args.concurrency.split(',')]:
+                drive(port, bodies, CONTENT_TYPES[args.format], concurrency, args.warmup)
+                timer.reset()
+
+                start = time.perf_counter()
+                latencies = drive(port, bodies, CONTENT_TYPES[args.format], concurrency, args.requests)
+                elapsed = time.perf_counter() - start
+                phases = timer.reset()
+
+                result = {
+                    'batch_size': batch_size,
+                    'concurrency': concurrency,
+                    'requests': len(latencies),
+                    'requests_per_s': len(latencies) / elapsed,
+                    'rows_per_s': len(latencies) * batch_size / elapsed,
+                    'latency': percentiles(latencies),
+                    'parse': percentiles(phases[:, 0]),
+                    'predict': percentiles(phases[:, 1]),
+                    'serialize': percentiles(phases[:, 2]),
+                }
+                results.append(result)
+                print(
+                    f'batch={batch_size:<5} concurrency={concurrency:<3} '
+                    f'{result["rows_per_s"]:>10.0f} rows/s  '
+                    f'p50={result["latency"]["p50_ms"]:.2f}ms p95={result["latency"]["p95_ms"]:.2f}ms '
+                    f'p99={result["latency"]["p99_ms"]:.2f}ms  '
+                    f'(parse {result["parse"]["p50_ms"]:.2f} / predict {result["predict"]["p50_ms"]:.2f} '
+                    f'/ serialize {result["serialize"]["p50_ms"]:.2f}ms p50)'
+                )
+
+        server.shutdown()
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'model': type(score.MODELS[score.CHAMPION].model).__name__,
+        'format': args.format,
+        # the scoring script's own settings, see `azure/deploy/README.md`
+        'env': {name: value for name, value in os.environ.items() if name.startswith('SCORE_')},
+        'results': results,
+    }
+    output = args.output or ROOT / 'tests' / 'load' / 'results' / f'{datetime.now():%Y%m%d-%H%M%S}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Results written to {output}')
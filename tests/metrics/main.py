@@ -0,0 +1,112 @@
+'''
+Offline check of the batched mlflow logger (`lib/pipeline/metrics.py`)
+
+Logs the same metrics and params to a local file store twice, once with a call per value like
+the stages used to, and once through `BatchLogger`, then checks that everything arrived and
+compares how long the logging calls held up the caller. `--latency-ms` adds a delay to every
+tracking call, to stand in for the round trip to the Azure ML tracking server.
+'''
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+from pipeline.metrics import BatchLogger
+
+
+class SlowClient(MlflowClient):
+    '''An `MlflowClient` whose logging calls each take (at least) `latency` seconds'''
+
+    def __init__(self, latency: float, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = 0
+
+    def _round_trip(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def log_metric(self, *args, **kwargs):
+        self._round_trip()
+        return super().log_metric(*args, **kwargs)
+
+    def log_param(self, *args, **kwargs):
+        self._round_trip()
+        return super().log_param(*args, **kwargs)
+
+    def log_batch(self, *args, **kwargs):
+        self._round_trip()
+        return super().log_batch(*args, **kwargs)
+
+
+def log_everything(log_metric, log_param, n_metrics: int, n_params: int, steps: int):
+    for i in range(n_params):
+        log_param(f'param {i}', i)
+    for step in range(steps):
+        for i in range(n_metrics):
+            log_metric(f'metric {i}', i * step, step)
+
+
+def check_run(client: MlflowClient, run_id: str, n_metrics: int, n_params: int, steps: int):
+    run = client.get_run(run_id)
+    assert len(run.data.params) == n_params, f'expected {n_params} params, got {len(run.data.params)}'
+    assert len(run.data.metrics) == n_metrics, f'expected {n_metrics} metrics, got {len(run.data.metrics)}'
+    for i in range(n_metrics):
+        history = client.get_metric_history(run_id, f'metric {i}')
+        assert sorted(m.step for m in history) == list(range(steps)), f'missing steps for metric {i}'
+        assert all(m.value == i * m.step for m in history), f'wrong values for metric {i}'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--metrics', type=int, default=20, help='distinct metrics to log')
+    parser.add_argument('--params', type=int, default=10, help='params to log')
+    parser.add_argument('--steps', type=int, default=5, help='values logged per metric')
+    parser.add_argument('--latency-ms', type=float, default=20, help='simulated tracking server round trip')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # newer mlflow versions want an explicit opt-in for the file store
+        os.environ.setdefault('MLFLOW_ALLOW_FILE_STORE', 'true')
+        tracking_uri = Path(tmp).resolve().as_uri()
+        mlflow.set_tracking_uri(tracking_uri)
+        experiment_id = mlflow.create_experiment('metrics-test')
+
+        client = SlowClient(args.latency_ms / 1000, tracking_uri=tracking_uri)
+        total = args.metrics * args.steps + args.params
+
+        # one round trip per value
+        run_id = client.create_run(experiment_id).info.run_id
+        start = time.perf_counter()
+        log_everything(
+            lambda key, value, step: client.log_metric(run_id, key, value, step=step),
+            lambda key, value: client.log_param(run_id, key, value),
+            args.metrics, args.params, args.steps
+        )
+        blocking = time.perf_counter() - start
+        check_run(client, run_id, args.metrics, args.params, args.steps)
+        print(f'one call per value: {total} values, {client.calls} calls, {blocking * 1000:.0f}ms blocking the caller')
+
+        # batched, on a background thread
+        client.calls = 0
+        run_id = client.create_run(experiment_id).info.run_id
+        logger = BatchLogger(run_id, client=client)
+        start = time.perf_counter()
+        log_everything(logger.log_metric, logger.log_param, args.metrics, args.params, args.steps)
+        blocking = time.perf_counter() - start
+        start = time.perf_counter()
+        logger.close()
+        closing = time.perf_counter() - start
+        check_run(client, run_id, args.metrics, args.params, args.steps)
+        print(f'BatchLogger:        {total} values, {client.calls} calls, {blocking * 1000:.0f}ms blocking the caller '
+              f'(+{closing * 1000:.0f}ms to flush on close)')
+
+    print('All metrics and params were logged')
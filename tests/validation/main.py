@@ -0,0 +1,123 @@
+'''
+Checks of the scoring script's request validation (`azure/deploy/validation.py`)
+
+Sends `FeatureValidator` valid batches and batches with one kind of bad row each, and checks that
+the valid ones come back as float64 matrices and that the bad ones are rejected with an error for
+exactly the bad rows (and columns). Numeric strings and booleans are rejected like any other
+non-number, even though NumPy would happily convert them, in the JSON records and columns formats too.
+Then times a valid batch.
+'''
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'azure' / 'deploy'))
+
+import payloads  # noqa: E402
+from validation import FeatureValidator, ValidationError  # noqa: E402
+
+N_FEATURES = len(payloads.FEATURE_COLS)
+
+
+def rows(n: int) -> list:
+    '''`n` valid rows, as JSON decodes them'''
+    return json.loads(json.dumps(np.random.default_rng(0).random((n, N_FEATURES)).tolist()))
+
+
+def with_value(data: list, row: int, column: int, value) -> list:
+    data = [list(r) for r in data]
+    data[row][column] = value
+    return data
+
+
+def expect_errors(validator: FeatureValidator, data, expected: list):
+    '''Checks `data` is rejected with `expected`, a list of `(row, error, columns)`'''
+    try:
+        validator(data)
+    except ValidationError as err:
+        actual = [(e.get('row'), e['error'], e.get('columns')) for e in err.errors]
+        assert actual == expected, f'expected {expected}, got {actual}'
+        assert err.n_invalid == sum(row is not None for row, _, _ in expected)
+        return err
+    raise AssertionError(f'expected {expected}, but the batch passed validation')
+
+
+def check(validator: FeatureValidator):
+    columns = payloads.FEATURE_COLS
+    data = rows(5)
+
+    X = validator(data)
+    assert X.dtype == np.float64 and X.shape == (5, N_FEATURES)
+    # a single row can be sent on its own, and integers are numbers too
+    assert validator([int(v * 100) for v in data[0]]).shape == (1, N_FEATURES)
+
+    checks = {
+        'numeric string': (with_value(data, 3, 5, '12.3'), [(3, 'Expected numbers', [columns[5]])]),
+        'boolean': (with_value(data, 1, 0, True), [(1, 'Expected numbers', [columns[0]])]),
+        'string in a single row': (with_value(data, 0, 2, '0.5')[0], [(0, 'Expected numbers', [columns[2]])]),
+        'null': (with_value(data, 2, 7, None), [(2, 'Non-finite values', [columns[7]])]),
+        'short row': (data[:2] + [data[2][:-1]] + data[3:], [(2, f'Expected {N_FEATURES} features, got {N_FEATURES - 1}', None)]),
+        'row that is not a list': (data[:4] + ['row'], [(4, f'Expected a list of {N_FEATURES} features, got str', None)]),
+        'empty batch': ([], [(None, 'Expected at least one row', None)]),
+    }
+    for name, (batch, expected) in checks.items():
+        expect_errors(validator, batch, expected)
+        print(f'ok: {name}')
+
+    # every bad row is listed, each with its own columns
+    batch = with_value(with_value(data, 0, 1, 'a'), 4, 9, False)
+    expect_errors(validator, batch, [(0, 'Expected numbers', [columns[1]]), (4, 'Expected numbers', [columns[9]])])
+    print('ok: several bad rows')
+
+
+def check_payloads(validator: FeatureValidator):
+    '''The JSON records and columns formats go through the same checks, after `payloads.decode()`'''
+    columns = payloads.FEATURE_COLS
+    data = rows(4)
+
+    def records(batch):
+        return {'data': [dict(zip(columns, row)) for row in batch]}
+
+    def by_column(batch):
+        return {'data': {name: [row[i] for row in batch] for i, name in enumerate(columns)}}
+
+    for name, encode in (('records', records), ('columns', by_column)):
+        decoded, _ = payloads.decode(json.dumps(encode(data)).encode(), 'application/json')
+        assert np.array_equal(validator(decoded), np.array(data)), name
+
+        batch = with_value(with_value(data, 1, 4, '1.5'), 3, 0, True)
+        decoded, _ = payloads.decode(json.dumps(encode(batch)).encode(), 'application/json')
+        expect_errors(validator, decoded, [(1, 'Expected numbers', [columns[4]]), (3, 'Expected numbers', [columns[0]])])
+        print(f'ok: {name} with a numeric string and a boolean')
+
+
+def time_valid(validator: FeatureValidator, batch_size: int, repeats: int) -> float:
+    data = rows(batch_size)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        validator(data)
+    return (time.perf_counter() - start) / repeats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-sizes', default='1,32,256', help='comma-separated rows per timed batch')
+    parser.add_argument('--repeats', type=int, default=2000, help='validations per batch size')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    validator = FeatureValidator(payloads.FEATURE_COLS)
+    check(validator)
+    check_payloads(validator)
+
+    print()
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        seconds = time_valid(validator, batch_size, args.repeats)
+        print(f'{batch_size:>5} valid rows: {seconds * 1e6:.1f}us')
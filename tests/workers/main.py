@@ -0,0 +1,143 @@
+'''
+Memory and throughput check of serving the compiled model from several processes
+
+Writes a synthetic compiled model with `--support-vectors` support vectors (large enough for its
+memory to stand out), then:
+- starts `--workers` processes that each load it like `score.init()` does, with and without `mmap`,
+  and reports their memory from `/proc/<pid>/smaps_rollup`. PSS splits shared pages between the
+  processes sharing them, so its total is the physical memory the workers actually use
+- predicts a large batch in this process, and through `PredictPool` (`azure/deploy/pool.py`),
+  with a smaller model of `--pool-support-vectors` (the kernel matrix is batch size x support vectors)
+
+Linux only, for `/proc`.
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pipeline import compiled
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / 'azure' / 'deploy'))
+
+import compiled_model  # noqa: E402
+from pool import PredictPool  # noqa: E402
+
+N_FEATURES = 26
+
+
+class SyntheticModel:
+    '''Random parameters in the shape of a polynomial-kernel SVC, for `compiled.export()`'''
+
+    def __init__(self, n_support_vectors: int, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.n_support_vectors = n_support_vectors
+
+    def kernel_expansion(self) -> dict:
+        return {
+            'kernel': 'poly',
+            'degree': 3,
+            'gamma': 1 / N_FEATURES,
+            'coef0': 1.0,
+            'support_vectors': self.rng.standard_normal((self.n_support_vectors, N_FEATURES)),
+            'dual_coef': self.rng.standard_normal(self.n_support_vectors),
+            'intercept': 0.0,
+            'classes': np.array([0, 1]),
+        }
+
+
+def memory_mb(pid: int) -> dict:
+    '''RSS, PSS and private memory of a process, in MB'''
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'private': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def worker(model_path: str, mmap: bool, loaded, done):
+    model = compiled_model.CompiledSVC.load(model_path, mmap=mmap)
+    # touch every page of the model, like serving requests would
+    model.predict(np.zeros((1, N_FEATURES)))
+    loaded.set()
+    done.wait()
+
+
+def measure_workers(model_path: str, n_workers: int, mmap: bool) -> list:
+    context = multiprocessing.get_context('spawn')
+    done = context.Event()
+    processes = []
+    for _ in range(n_workers):
+        loaded = context.Event()
+        process = context.Process(target=worker, args=(model_path, mmap, loaded, done))
+        process.start()
+        processes.append((process, loaded))
+    for _, loaded in processes:
+        loaded.wait()
+
+    memory = [memory_mb(process.pid) for process, _ in processes]
+    done.set()
+    for process, _ in processes:
+        process.join()
+    return memory
+
+
+def time_predict(predict, X: np.ndarray, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(X)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--support-vectors', type=int, default=200000, help='support vectors of the synthetic model')
+    parser.add_argument('--pool-support-vectors', type=int, default=5000,
+                        help='support vectors of the synthetic model predicted through the pool')
+    parser.add_argument('--workers', type=int, default=4, help='processes loading the model')
+    parser.add_argument('--batch-size', type=int, default=4096, help='rows of the batch to predict')
+    parser.add_argument('--repeats', type=int, default=5, help='timed predictions, the median is reported')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = str(compiled.export(SyntheticModel(args.support_vectors), Path(tmp) / compiled.FILE_NAME))
+        print(f'Model file: {os.path.getsize(model_path) / 2**20:.1f}MB, {os.cpu_count()} cores\n')
+
+        for mmap in (False, True):
+            memory = measure_workers(model_path, args.workers, mmap)
+            print(f'{args.workers} workers, mmap={mmap}:')
+            for name in ('rss', 'pss', 'private'):
+                values = [m[name] for m in memory]
+                print(f'  {name:<8} {np.mean(values):8.1f}MB per worker, {np.sum(values):8.1f}MB total')
+            print()
+
+        model_path = str(compiled.export(SyntheticModel(args.pool_support_vectors), Path(tmp) / 'pool_model.npz'))
+        X = np.random.default_rng(1).standard_normal((args.batch_size, N_FEATURES))
+        model = compiled_model.CompiledSVC.load(model_path, mmap=True)
+        single = time_predict(model.predict, X, args.repeats)
+        print(f'{args.batch_size} rows in this process: {single * 1000:.1f}ms')
+
+        pool = PredictPool(model.predict, model_path, args.workers, min_rows=1)
+        pool.warm_up(X[:1])
+        pooled = time_predict(pool.predict, X, args.repeats)
+        assert (pool.predict(X) == model.predict(X)).all(), 'the pool predicts differently'
+        pool.shutdown()
+        print(f'{args.batch_size} rows across {args.workers} processes: {pooled * 1000:.1f}ms ({single / pooled:.2f}x)')